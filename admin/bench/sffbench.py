@@ -0,0 +1,345 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Measure how the SFF build manager scales with the size of a design.
+
+Generates synthetic SoC projects of N units, one directory and wscript per
+unit like the waf_test projects, then times for each N:
+1) configure
+2) configure --no_code_cache, every wscript compiled, see SFFcodecache
+3) configure --check
+4) a no-op dump_source, all the dump files already up to date
+5) verify_source after changing one source of a leaf unit
+The simulator tools are replaced by stubs which do nothing, so only the
+time spent in waf and the SFF tools is measured. The times per unit should
+stay roughly flat as N grows.
+
+The shape of the design:
+- u0 is the top level, with a testbench.
+- With --depth=0 the units form a tree, each unit using the next FANOUT
+  units. Otherwise the other units are split in DEPTH layers, u0 uses the
+  whole first layer and each unit uses FANOUT units of the next layer, so
+  units are shared between several users.
+- Each unit has SRCS sources in src/, each including INCLUDES headers of
+  its own, and VIEWS views besides the default one.
+
+The results are appended to a JSON lines file (--results). Each run is
+compared to the last recorded run with the same parameters and the command
+fails if any time grew by more than --tolerance percent.
+
+Usage:
+    source admin/setup_env.bash
+    python admin/bench/sffbench.py --units=1000,2000,4000 --fanout=4
+"""
+
+from __future__ import print_function
+import json
+import optparse
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import time
+
+TOP_WSCRIPT = """#! /usr/bin/env python
+# encoding: utf-8
+# Generated by sffbench.py
+
+import os
+toolpath = os.environ['WAFDIR'] + '/../waf-extensions'
+
+top = '.'
+out = 'build'
+
+def options(ctx):
+    ctx.load('SFFbuildmgr', tooldir=toolpath)
+    ctx.load('SFFbuild', tooldir=toolpath)
+
+def configure(ctx):
+    ctx.load('SFFbuildmgr', tooldir=toolpath)
+    ctx.load('SFFbuild', tooldir=toolpath)
+    ctx.recurse([{units}])
+    ctx.SFFUnits.finalize()
+
+def build(ctx):
+    pass
+"""
+
+UNIT_WSCRIPT = """#! /usr/bin/env python
+# encoding: utf-8
+# Generated by sffbench.py
+
+def configure(ctx):
+    ctx.SFFUnits.add('{name}'{use})
+{views}"""
+
+VIEW = """    ctx.SFFUnits.addview('{name}', '{view}', src_dir='src')
+"""
+
+UNIT_SRC = """{includes}
+module {module}();
+endmodule
+"""
+
+TB_SRC = """module tb_{name}();
+{name} dut();
+endmodule
+"""
+
+HEADER = """`ifndef {guard}
+`define {guard}
+`endif
+"""
+
+STUB = """#!/bin/sh
+# Generated by sffbench.py, stands in for a simulator tool
+if [ "$1" = "-version" ]; then echo "sffbench stub 1.0"; exit 0; fi
+case `basename $0` in vlib) mkdir -p "$1";; esac
+exit 0
+"""
+
+STUB_TOOLS = ('ncvlog', 'ncvhdl', 'ncelab', 'ncsim',
+    'vlog', 'vcom', 'vlib', 'vsim', 'vopt')
+"""The tools configured by SFFincisive and SFFmodelsim"""
+
+STEPS = ('configure', 'no_code_cache', 'check', 'dump_source', 'rebuild')
+"""The timed steps, in the order they run"""
+
+
+def unit_name(i):
+    return 'u{0}'.format(i)
+
+def layers(units, depth):
+    """Split the units but u0 into depth layers as even as possible"""
+    rest = list(range(1, units))
+    size = len(rest) // depth
+    extra = len(rest) % depth
+    out = []
+    for k in range(depth):
+        n = size + (1 if k < extra else 0)
+        if n:
+            out.append(rest[:n])
+        rest = rest[n:]
+    return out
+
+def unit_uses(units, depth, fanout):
+    """Return the list of unit indexes used by each unit"""
+    uses = [[] for i in range(units)]
+    if not depth:
+        for i in range(units):
+            first = i * fanout + 1
+            uses[i] = list(range(first, min(first + fanout, units)))
+        return uses
+    levels = layers(units, depth)
+    if levels:
+        uses[0] = list(levels[0])
+    for (upper, lower) in zip(levels, levels[1:]):
+        for (p, i) in enumerate(upper):
+            picks = [lower[(p * fanout + m) % len(lower)]
+                for m in range(fanout)]
+            # Keep the first occurrence of each pick, in order
+            uses[i] = [j for (n, j) in enumerate(picks) if j not in picks[:n]]
+    return uses
+
+def write(path, txt):
+    with open(path, 'w') as f:
+        f.write(txt)
+
+def source_path(path, name, s):
+    return os.path.join(path, name, 'src', '{0}_{1}.sv'.format(name, s))
+
+def generate(path, opts, units):
+    """Write a project of units units to directory path"""
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    names = [unit_name(i) for i in range(units)]
+    write(os.path.join(path, 'wscript'), TOP_WSCRIPT.format(
+        units=', '.join(repr(n) for n in names)))
+    uses = unit_uses(units, opts.depth, opts.fanout)
+    for (i, name) in enumerate(names):
+        os.makedirs(os.path.join(path, name, 'src'))
+        use = ''
+        if uses[i]:
+            use = ", use='{0}'".format(','.join(unit_name(j)
+                for j in uses[i]))
+        views = ''.join(VIEW.format(name=name, view='v{0}'.format(v))
+            for v in range(opts.views))
+        write(os.path.join(path, name, 'wscript'),
+            UNIT_WSCRIPT.format(name=name, use=use, views=views))
+        for h in range(opts.includes):
+            write(os.path.join(path, name, 'src', '{0}_{1}.vh'.format(
+                name, h)), HEADER.format(guard='{0}_{1}_VH'.format(
+                name.upper(), h)))
+        includes = '\n'.join('`include "{0}_{1}.vh"'.format(name, h)
+            for h in range(opts.includes))
+        for s in range(opts.srcs):
+            module = name if s == 0 else '{0}_{1}'.format(name, s)
+            write(source_path(path, name, s), UNIT_SRC.format(
+                includes=includes, module=module))
+    os.makedirs(os.path.join(path, names[0], 'tb'))
+    write(os.path.join(path, names[0], 'tb', 'tb_{0}.sv'.format(names[0])),
+        TB_SRC.format(name=names[0]))
+    return uses
+
+def leaf(uses):
+    """Return the index of a unit using no other unit"""
+    for i in range(len(uses) - 1, -1, -1):
+        if not uses[i]:
+            return i
+    return 0
+
+def write_stubs(path):
+    """Write the stub tools to directory path"""
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for tool in STUB_TOOLS:
+        p = os.path.join(path, tool)
+        write(p, STUB)
+        os.chmod(p, os.stat(p).st_mode | stat.S_IXUSR | stat.S_IXGRP |
+            stat.S_IXOTH)
+
+def waf(path, env, *args):
+    """Run waf in path and return the wall clock time it took"""
+    cmd = [sys.executable, os.path.join(os.environ['WAFDIR'], 'waf')]
+    cmd += list(args)
+    start = time.time()
+    proc = subprocess.Popen(cmd, cwd=path, env=env, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT)
+    out = proc.communicate()[0]
+    elapsed = time.time() - start
+    if proc.returncode:
+        sys.stderr.write(out.decode('utf-8', 'replace'))
+        raise SystemExit('waf {0} failed in {1}'.format(' '.join(args), path))
+    return elapsed
+
+def touch_source(path, name):
+    """Change the content of the first source of unit name"""
+    with open(source_path(path, name, 0), 'a') as f:
+        f.write('// touched by sffbench.py {0}\n'.format(time.time()))
+
+def bench(path, env, opts, uses):
+    """Time the STEPS in the project at path, returns {step: seconds}"""
+    top = '--top_level=' + unit_name(0)
+    def best(prepare, *args):
+        times = []
+        for i in range(opts.repeat):
+            prepare()
+            times.append(waf(path, env, *args))
+        return min(times)
+    nothing = lambda: None
+    times = {}
+    times['configure'] = best(nothing, 'configure', top)
+    times['no_code_cache'] = best(nothing, 'configure', top,
+        '--no_code_cache')
+    times['check'] = best(nothing, 'configure', top, '--check')
+    waf(path, env, 'dump_source')
+    times['dump_source'] = best(nothing, 'dump_source')
+    waf(path, env, 'verify_source', '-j{0}'.format(opts.jobs))
+    name = unit_name(leaf(uses))
+    times['rebuild'] = best(lambda: touch_source(path, name),
+        'verify_source', '-j{0}'.format(opts.jobs))
+    return times
+
+def params(opts, units):
+    """The parameters identifying comparable results"""
+    return {'units': units, 'depth': opts.depth, 'fanout': opts.fanout,
+        'srcs': opts.srcs, 'includes': opts.includes, 'views': opts.views,
+        'jobs': opts.jobs, 'sim_env': opts.sim_env}
+
+def load_results(path):
+    """Return the results recorded in path, oldest first"""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def previous(results, p):
+    """Return the last recorded result with parameters p or None"""
+    for r in reversed(results):
+        if r['params'] == p:
+            return r
+    return None
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--units', default='500,1000,2000,4000',
+        help='comma separated list of unit counts [default: %default]')
+    parser.add_option('--depth', type='int', default=0,
+        help='layers of units below the top, 0 for a tree as deep as '
+        'needed [default: %default]')
+    parser.add_option('--fanout', type='int', default=4,
+        help='units used by each unit [default: %default]')
+    parser.add_option('--srcs', type='int', default=1,
+        help='sources per unit [default: %default]')
+    parser.add_option('--includes', type='int', default=0,
+        help='headers included by each source [default: %default]')
+    parser.add_option('--views', type='int', default=0,
+        help='views per unit besides the default one [default: %default]')
+    parser.add_option('--jobs', type='int', default=4,
+        help='waf -j for the rebuild [default: %default]')
+    parser.add_option('--sim_env', default='incisive',
+        choices=('incisive', 'modelsim'),
+        help='SFF_SIM_ENV of the projects [default: %default]')
+    parser.add_option('--repeat', type='int', default=3,
+        help='runs per step, the fastest is kept [default: %default]')
+    parser.add_option('--dir', default='sffbench_out',
+        help='directory to generate the projects in [default: %default]')
+    parser.add_option('--results', default='sffbench_results.jsonl',
+        help='file the results are appended to [default: %default]')
+    parser.add_option('--tolerance', type='float', default=20.0,
+        help='percentage a time may grow by before failing [default: '
+        '%default]')
+    (opts, args) = parser.parse_args()
+
+    if 'WAFDIR' not in os.environ:
+        raise SystemExit('WAFDIR is not set, source admin/setup_env.bash')
+    if opts.fanout < 1 or opts.srcs < 1 or opts.depth < 0:
+        raise SystemExit('--fanout and --srcs must be at least 1, --depth '
+            'at least 0')
+
+    stubs = os.path.abspath(os.path.join(opts.dir, 'stubs'))
+    write_stubs(stubs)
+    env = dict(os.environ)
+    env['PATH'] = stubs + os.pathsep + env.get('PATH', '')
+    env['SFF_SIM_ENV'] = opts.sim_env
+    env.pop('SFF_LIB_CACHE', None)
+
+    results = load_results(opts.results)
+    regressions = []
+    print('{0:>8}'.format('units') + ''.join('{0:>16}'.format(s + '/s')
+        for s in STEPS) + '{0:>14}'.format('per unit/ms'))
+    for units in [int(n) for n in opts.units.split(',')]:
+        path = os.path.abspath(os.path.join(opts.dir, str(units)))
+        uses = generate(path, opts, units)
+        times = bench(path, env, opts, uses)
+        total = sum(times.values())
+        print('{0:>8}'.format(units) + ''.join('{0:>16.3f}'.format(times[s])
+            for s in STEPS) + '{0:>14.3f}'.format(1000.0 * total / units))
+
+        p = params(opts, units)
+        old = previous(results, p)
+        if old:
+            for s in STEPS:
+                if s not in old['times']:
+                    continue
+                change = 100.0 * (times[s] - old['times'][s]) / old['times'][s]
+                if change > opts.tolerance:
+                    regressions.append('{0} units {1}: {2:.3f}s, was {3:.3f}s'
+                        ' ({4:+.0f}%)'.format(units, s, times[s],
+                        old['times'][s], change))
+        with open(opts.results, 'a') as f:
+            f.write(json.dumps({'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'params': p, 'times': times}, sort_keys=True) + '\n')
+
+    if regressions:
+        print('Slower than the last recorded run by more than {0}%:'.format(
+            opts.tolerance))
+        for r in regressions:
+            print('  ' + r)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
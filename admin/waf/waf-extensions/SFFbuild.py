@@ -8,13 +8,17 @@ Classes and helper functions used to provide
 "sim_source"
 "verify_source"
 "dump_source"
+"regress"
+"watch", see SFFwatch
 """
 
 import os
 from waflib import Context
 from waflib import Build
+from waflib import Errors
 from waflib import Logs
 from waflib import Node
+from waflib import Options
 from waflib import TaskGen
 from waflib import Task
 from waflib import Utils
@@ -23,16 +27,20 @@ from waflib.TaskGen import feature, before_method, after_method
 from SFFbuildmgr import SFF_verilog_scan
 from SFFbuildmgr import SFFUnitsCont, SFFUnit, SFFView, load_SFFUnits
 import pickle
+import SFFutil
 # import needed simulation environments 
 import SFFincisive
 import SFFmodelsim
+import SFFverilator
+import SFFwatch
 
 INCISIVE_ENV = 'incisive'
 MODELSIM_ENV = 'modelsim'
-VALID_ENVS = [INCISIVE_ENV, MODELSIM_ENV]
+VERILATOR_ENV = 'verilator'
+VALID_ENVS = [INCISIVE_ENV, MODELSIM_ENV, VERILATOR_ENV]
 
 SRC_DUMP = 'srcs.dump'
-INC_DUMP = 'incs.dump' 
+INC_DUMP = 'incs.dump'
 
 def get_sim_env():
     """
@@ -45,6 +53,27 @@ def get_sim_env():
         return VALID_ENVS[0]
     return sim_env
 
+SIM_MODULES = {INCISIVE_ENV: SFFincisive, MODELSIM_ENV: SFFmodelsim,
+    VERILATOR_ENV: SFFverilator}
+
+REGRESS_ARGS = {INCISIVE_ENV: '-exit', MODELSIM_ENV: '-c -do "run -a;q"',
+    VERILATOR_ENV: ''}
+"""Batch mode options of each simulator for the regress command"""
+
+REGRESS_DIR = 'regress'
+SUMMARY = 'summary.txt'
+
+def options(ctx):
+    ctx.add_option('--tests', action='store',
+                   help=('Test list run by the regress command, one test per '
+                         'line as: top_level [seed[,seed...]] [+plusarg...]'))
+
+    ctx.add_option('--watch_poll', action='store_true', default=False,
+                   help=('Make the watch command poll the directories '
+                         'instead of using inotify, for NFS.'))
+
+    SFFverilator.options(ctx)
+
 def configure(ctx):
     """
     Simulator: Find all the necessary parts of the chosen Simulator.
@@ -54,7 +83,9 @@ def configure(ctx):
     if sim_env == INCISIVE_ENV:
         SFFincisive.configure(ctx)
     elif sim_env == MODELSIM_ENV:
-        SFFmodelsim.configure(ctx)    
+        SFFmodelsim.configure(ctx)
+    elif sim_env == VERILATOR_ENV:
+        SFFverilator.configure(ctx)    
 
 class verify_source_ctx(Build.BuildContext):
     """
@@ -79,6 +110,8 @@ def verify_source(ctx):
         SFFincisive._simulate(ctx, '-exit')
     elif sim_env == MODELSIM_ENV:
         SFFmodelsim._simulate(ctx, '-c -do "run -a;q"')
+    elif sim_env == VERILATOR_ENV:
+        SFFverilator._simulate(ctx, '')
 
 Context.g_module.__dict__['verify_source'] = verify_source
 """Inject the verify_source command into the wscript"""
@@ -105,10 +138,132 @@ def sim_source(ctx):
         SFFincisive._simulate(ctx, '-gui')
     elif sim_env == MODELSIM_ENV:
         SFFmodelsim._simulate(ctx, '')
+    elif sim_env == VERILATOR_ENV:
+        SFFverilator._simulate(ctx, '-gui')
 
 Context.g_module.__dict__['sim_source'] = sim_source
 """Inject the sim_source command into the wscript"""
 
+class regress_ctx(Build.BuildContext):
+    """
+    Subclass waflib.Build.BuildContext to create a new command called
+    regress, which runs every test of the list given by --tests.
+    """
+    cmd = 'regress'
+    fun = 'regress'
+
+Context.g_module.__dict__['regress_ctx'] = regress_ctx
+
+def read_test_list(path):
+    """
+    Parse the test list path. Each line holds a top level configured, an
+    optional comma-separated list of seeds and the plusargs to pass to the
+    simulator. Everything after a # is a comment. Returns a list of
+    (name, top_level, seed, plusargs), one test per seed.
+    """
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except EnvironmentError:
+        raise Errors.WafError('Could not read the test list %s' % path)
+
+    tests = []
+    for (lineno, line) in enumerate(lines, 1):
+        words = line.split('#', 1)[0].split()
+        if not words:
+            continue
+        top = words.pop(0)
+        seeds = [None]
+        if words and not words[0].startswith('+'):
+            seeds = words.pop(0).split(',')
+            if not all(seed.isdigit() for seed in seeds):
+                raise Errors.WafError('%s:%d: seeds must be integers, got %r'
+                    % (path, lineno, ','.join(seeds)))
+        for w in words:
+            if not w.startswith('+'):
+                raise Errors.WafError('%s:%d: expected a plusarg, got %r' %
+                    (path, lineno, w))
+        for seed in seeds:
+            name = '%s.%d' % (top, lineno)
+            if seed is not None:
+                name += '.' + seed
+            tests.append((name, top, seed, words))
+    return tests
+
+def regress(ctx):
+    """
+    Load the SFFUnits of every top level in the test list.
+    Compile each library once, elaborate each testbench once and run each
+    test as its own task in build/regress/<test>, so waf runs as many at a
+    time as -j allows.
+    Write the pass/fail, run time and error count of each test to
+    build/regress/summary.txt once all of them have run. The output of each
+    test is in build/regress/<test>/sim.log.
+    """
+    if not Options.options.tests:
+        raise Errors.WafError('regress needs a test list, use --tests=FILE')
+    tests = read_test_list(os.path.join(Context.launch_dir,
+        Options.options.tests))
+    if not tests:
+        raise Errors.WafError('No tests in %s' % Options.options.tests)
+
+    sim_env = get_sim_env()
+    sim = SIM_MODULES[sim_env]
+    tops = []
+    for (name, top, seed, plusargs) in tests:
+        if top not in tops:
+            tops.append(top)
+
+    ctx.env['SFFUnits'] = load_SFFUnits(ctx, tops)
+    units = dict((top, ctx.env['SFFUnits'].getunit(top)) for top in tops)
+    tb_tasks = sim.build_libraries(ctx, [units[top] for top in tops])
+
+    regress_dir = ctx.bldnode.make_node(REGRESS_DIR)
+    elabs = {}
+    for top in tops:
+        elabs[top] = sim.elaborate(ctx, units[top], tb_tasks[top],
+            regress_dir.make_node(top))
+
+    ctx.sff_tests = []
+    for (name, top, seed, plusargs) in tests:
+        ctx.sff_tests.append(sim.simulate(ctx, units[top], elabs[top],
+            regress_dir.make_node(name), REGRESS_ARGS[sim_env], test=name,
+            seed=seed, plusargs=plusargs))
+    ctx.add_post_fun(regress_summary)
+
+Context.g_module.__dict__['regress'] = regress
+
+def regress_summary(ctx):
+    """
+    Write and print the result of each test. Fails the command if any test
+    failed or did not run. A test stopped early by its output, see
+    SFFsimlog, fails with the reason.
+    """
+    lines = []
+    failed = 0
+    for tsk in ctx.sff_tests:
+        reason = ''
+        if tsk.status is None:
+            result = 'NOT RUN'
+        elif tsk.status:
+            result = 'FAIL'
+            reason = tsk.matcher.reason or 'exit status %d' % tsk.status
+        else:
+            result = 'PASS'
+        if result != 'PASS':
+            failed += 1
+        lines.append(('%-40s %-8s %8.2fs %6d errors %s' % (tsk.test, result,
+            tsk.duration or 0.0, tsk.matcher.errors, reason)).rstrip())
+    lines.append('%d of %d tests passed' % (len(lines) - failed, len(lines)))
+
+    summary = ctx.bldnode.make_node(REGRESS_DIR).make_node(SUMMARY)
+    summary.write('\n'.join(lines) + '\n')
+    for line in lines:
+        Logs.info(line)
+    if failed:
+        raise Errors.WafError('%d tests failed, see %s' % (failed,
+            summary.abspath()))
+
 class dump_source_ctx(Build.BuildContext):
     cmd = 'dump_source'
     fun = 'dump_source'
@@ -116,89 +271,40 @@ class dump_source_ctx(Build.BuildContext):
 Context.g_module.__dict__['dump_source_ctx'] = dump_source_ctx
 
 def dump_source(ctx):
-    """ 
-    Load the SFFUnits into the system. 
-    Output each file to standard out.
     """
-    ctx.env['SFFUnits'] = load_SFFUnits(ctx)
-
-    """
-    Creates the directory path and nodes in the build directory.
-    Creates a taskgen from each other library in units_hdl
+    Load the SFFUnits into the system.
+    Write the source and include file lists of each unit used by the top
+    level to build/<dir_of_wscript>/work_dump/, straight from the units:
+    nothing is scanned and no task is run. Units sharing a directory share
+    the files, each unit's source list sorted by path and ending with an
+    empty line. A file is only replaced when its content changes.
     """
+    ctx.env['SFFUnits'] = load_SFFUnits(ctx)
     top = ctx.env['SFFUnits'].getunit(ctx.env.top_level)
 
-    """
-    Ensure the output files are all cleared before running the command
-    to prevent duplicate files in the output.
-    """
-    for u in top.synu_deps + top.simu_deps:
-      lib = u.script.parent.get_bld().make_node('work_dump')
-      src_file = ctx.out_dir + '/' + lib.bldpath() + '/' + SRC_DUMP
-      inc_file = ctx.out_dir + '/' + lib.bldpath() + '/' + INC_DUMP
-      try:
-        os.remove(src_file)
-      except:
-        pass
-      try:
-        os.remove(inc_file)
-      except:
-        pass
-      
-  
+    dumps = {}
+    order = []
     for u in top.synu_deps + top.simu_deps:
-      lib = u.script.parent.get_bld().make_node('work_dump')
-      lib.mkdir()
-      
-      if u.use('use'):
-        tsk = DumpTask(
-          name=u.name,
-          source=u.use('src'),
-          includes=u.use('includes'),
-          after=u.use('use'),
-          output=lib,
-          scan=SFF_verilog_scan,
-          env=ctx.env)
-        ctx.add_to_group(tsk) 
-      else:
-        tsk = DumpTask(
-          name=u.name,
-          source=u.use('src'),
-          includes=u.use('includes'),
-          output=lib,
-          scan=SFF_verilog_scan,
-          env=ctx.env)
-        ctx.add_to_group(tsk)
+        lib = u.script.parent.get_bld().make_node('work_dump')
+        if lib not in dumps:
+            dumps[lib] = ([], [])
+            order.append(lib)
+        (srcs, incs) = dumps[lib]
+        # A set of nodes, ordered by path for the files to be stable
+        srcs.extend(sorted(s.bldpath() + '\n' for s in u.use('src')))
+        srcs.append('\n')
+        incs.extend(i.bldpath() + '\n' for i in u.incpath('includes')[0])
+        incs.append('\n')
 
-Context.g_module.__dict__['dump_source'] = dump_source
+    written = 0
+    for lib in order:
+        lib.mkdir()
+        (srcs, incs) = dumps[lib]
+        written += SFFutil.write_if_changed(lib.make_node(SRC_DUMP),
+            ''.join(srcs))
+        written += SFFutil.write_if_changed(lib.make_node(INC_DUMP),
+            ''.join(incs))
+    Logs.info('dump_source: %d of %d files updated' % (written,
+        2 * len(order)))
 
-class DumpTask(Task.Task):
-    def __init__(self, *k, **kw):
-        Task.Task.__init__(self, *k, **kw)
-
-        self.set_inputs(list(kw['source']))
-        self.set_outputs(kw['output'])
-        self.includes = kw['includes']
-        from types import MethodType
-        self.scan = MethodType(kw['scan'],self)
-
-    def __str__(self):
-        return '%s: %s\n' % (self.__class__.__name__,self.outputs[0])
-
-    def run(self):
-        src = ''
-        for s in self.inputs:
-            src += s.bldpath() + '\n'
-        tgt = self.outputs[0].bldpath()
-        incs = ''
-        if hasattr(self.generator,'includes'):
-            incs = ''
-            for inc in getattr(self.generator,'includes'):
-              incs += inc.bldpath() + '\n'
-        src_file = self.outputs[0].bldpath()+'/'+ SRC_DUMP
-        inc_file = self.outputs[0].bldpath()+'/'+ INC_DUMP
-        cmd_src = "echo '%s' >> %s" % (src, src_file)
-        cmd_include = "echo '%s' >> %s" % (incs, inc_file)
-        cmd = "%s;%s" % (cmd_src, cmd_include)
-        
-        return self.exec_command(cmd)
+Context.g_module.__dict__['dump_source'] = dump_source
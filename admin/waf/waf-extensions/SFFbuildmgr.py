@@ -20,16 +20,46 @@ from waflib import Errors
 from waflib import Context
 from waflib import Options
 from waflib import Node
-import pickle
 import os.path
 import sys
 import SFFutil
 import SFFerrors
+import SFFpreproc
+import SFFunitdb
+import SFFcodecache
+import SFFconfcache
+import SFFmanifest
+import SFFhash
+
+SCANNERS = ('native', 'vppreproc', 'validate')
+"""Choices for --verilog_scanner, see SFF_verilog_scan"""
+
+try:
+    Build.BuildContext.sff_restore_real
+except AttributeError:
+    """
+    Persist bld.sff_cache, a dictionary the SFF tools keep their own data in,
+    in the build database next to task_sigs. The database is renamed so a
+    database written without it is never loaded (a one-off full rebuild).
+    """
+    Context.DBFILE += '_sff'
+    Build.SAVED_ATTRS.append('sff_cache')
+
+    def restore(self):
+        self.sff_cache = {}
+        self.sff_restore_real()
+    Build.BuildContext.sff_restore_real = Build.BuildContext.restore
+    Build.BuildContext.restore = restore
+
+SFFcodecache.install()
 
 
 def options(ctx):
     ctx.add_option('--top_level', action='store',
-                   help=('Set the root unit of the design'))
+                   help=('Set the root unit of the design. configure accepts '
+                         'a comma-separated list of units, the other '
+                         'commands then select one of them [default: the '
+                         'first one configured]'))
 
     ctx.add_option('--views', action='store', default='default',
                    help=('Set an ordered, comma-separated, list of views to '
@@ -38,18 +68,90 @@ def options(ctx):
     ctx.add_option('--check', action='store_true', default=False,
                    help=('Check all units for correctness.'))
 
+    ctx.add_option('--verilog_scanner', action='store', default='native',
+                   choices=SCANNERS,
+                   help=('Select the Verilog include scanner: native, '
+                         'vppreproc or validate (run both and warn on any '
+                         'difference) [default: %default]'))
+
+    ctx.add_option('--incremental', action='store_true', default=False,
+                   help=('Only recompile the changed sources of a library '
+                         'and the sources that include changed files.'))
+
+    ctx.add_option('--compile_workers', action='store_true', default=False,
+                   help=('Run the library compiles on worker processes '
+                         'forked once per build thread and report the '
+                         'latency of each request.'))
+
+    ctx.add_option('--stat_hash', action='store_true', default=False,
+                   help=('Only hash again the sources whose inode, size or '
+                         'modification time changed since the last build.'))
+
+    ctx.add_option('--hash_algo', action='store', default='md5',
+                   choices=SFFhash.ALGOS,
+                   help=('Digest of the source signatures, changing it '
+                         'rebuilds everything once [default: %default]'))
+
+    ctx.add_option('--hash_threads', action='store', type='int', default=0,
+                   help=('Hash the inputs of the tasks with this many '
+                         'threads before scheduling them, 0 to hash them '
+                         'as needed [default: %default]'))
+
+    ctx.add_option('--trace', action='store', metavar='FILE',
+                   help=('Write the timings of every task of the build to '
+                         'FILE as Chrome trace events and summarize the '
+                         'critical path and the idle workers.'))
+
+    ctx.add_option('--fatal_regex', action='store',
+                   help=('Stop a simulation when a line of its output '
+                         'matches this regular expression [default: Incisive'
+                         ' *F, Modelsim ** Fatal and UVM_FATAL messages]'))
+
+    ctx.add_option('--error_regex', action='store',
+                   help=('Count the lines of a simulation output matching '
+                         'this regular expression as errors [default: '
+                         'Incisive *E, Modelsim ** Error and UVM_ERROR '
+                         'messages]'))
+
+    ctx.add_option('--max_errors', action='store', type='int', default=0,
+                   help=('Stop a simulation once it reports this many '
+                         'errors, 0 for no limit [default: %default]'))
+
+    ctx.add_option('--incremental_configure', action='store_true',
+                   default=False,
+                   help=('Replay the unit definitions of the wscripts '
+                         'unchanged since the last configure instead of '
+                         'executing them.'))
+
+    ctx.add_option('--no_code_cache', action='store_true', default=False,
+                   help=('Compile the wscripts instead of loading the code '
+                         'cached by the previous runs.'))
+
+    ctx.add_option('--no-cache', action='store_true', default=False,
+                   dest='no_cache',
+                   help=('Debug: resolve the nodes of a unit on every '
+                         'request instead of caching them for the run.'))
+
 def configure(ctx):
     if not ctx.options.top_level:
         raise Errors.ConfigurationError(
             'SoCManager: Please set a top level unit by running waf '
             'configure --top_level=<top_level>')
-    ctx.env['top_level'] = ctx.options.top_level
+    ctx.env['top_levels'] = SFFutil.strtolist(ctx.options.top_level)
+    ctx.env['top_level'] = ctx.env['top_levels'][0]
     ctx.env['views'] = ctx.options.views
     ctx.env['check'] = ctx.options.check
+    ctx.env['SFF_SCANNER'] = ctx.options.verilog_scanner
+    ctx.env['SFF_INCREMENTAL'] = ctx.options.incremental
 
     """Create class in the context to hold/manipulate the SFFUnits."""
     ctx.SFFUnits = ctx.SFFUnitsCont()
 
+    """Record the SFF calls of each wscript, replaying unchanged ones."""
+    ctx.SFFUnits.conf_cache = SFFconfcache.ConfCache(ctx,
+        ctx.options.incremental_configure)
+    ctx.recurse = ctx.SFFUnits.conf_cache.recurse
+
     """File extensions to compile as Verilog."""
     ctx.env.VLOG_EXT = ['.v']
     """File extensions to compile as VHDL."""
@@ -61,9 +163,11 @@ def configure(ctx):
 
     """
     Static version of Perl vppreproc http://www.veripool.org/ used to parse
-    verilog for headers.
+    verilog for headers. Only required when it is the selected scanner.
     """
-    ctx.find_program('vppreproc')
+    ctx.find_program('vppreproc',
+        mandatory=(ctx.env['SFF_SCANNER'] != 'native'))
+    ctx.msg('Verilog include scanner', ctx.env['SFF_SCANNER'], color='BLUE')
 
 @conf
 class SFFUnitsCont():
@@ -79,10 +183,13 @@ class SFFUnitsCont():
         self.ctx = ctx
         self.units = {}
         self.top_level = ctx.env['top_level']
+        self.top_levels = ctx.env['top_levels'] or [self.top_level]
+        self.tops = {}
         self._packed = False
         self.views = SFFutil.strtolist(ctx.env['views'])
         self.synu_deps = []
         self.simu_deps = []
+        self.conf_cache = None
 
     def getunit(self, unit):
         if isinstance(unit, list):
@@ -104,6 +211,8 @@ class SFFUnitsCont():
                     unit.name, self.ctx.cur_script.srcpath(),
                     self.getunit(unit.name).script.srcpath()))
         self.units[unit.name] = unit
+        if self.conf_cache:
+            self.conf_cache.record('add', args, kwargs, unit.name)
 
     def addview(self, name, view, **kwargs):
         if name not in self.units:
@@ -113,52 +222,98 @@ class SFFUnitsCont():
                     name, self.ctx.cur_script.srcpath(), view))
         else:
             self.units[name].addview(view, **kwargs)
+        if self.conf_cache:
+            self.conf_cache.record('addview', (name, view), kwargs, name)
 
-    def _buildunitdeps(self, unit_order, unit):
+    def _unitclosure(self, unit, parent=None):
         """
-        Order a list which can be built from left to right to build all
-        units from a dictionary of named units which have
-        a subkey 'use' referring to other named prerequisite units.
-        If memory becomes a problem then change to iterative from recursion.
+        Return a tuple of the units which must be built to build unit, in
+        an order which can be built from left to right, ending with unit.
+        The units are followed through their 'use' key depth first.
+
+        The closures are computed iteratively and memoized in
+        self._closures, so every unit is visited once however many units
+        use it. A unit's closure is the closures of its uses in order,
+        without repeats, followed by the unit itself.
         """
-        if unit in unit_order:
-            return unit_order
-        elif 'use' in self.units[unit]._k.keys():
-            for u in self.units[unit]._k.use('use'):
-                try:
-                    unit_order = self._buildunitdeps(unit_order, u)
-                except KeyError:
-                    raise Errors.ConfigurationError(('Unit \'{0}\''
-                        ' required by \'{1}\' defined in \'{2}\' has not been'
-                        ' defined.').format(u, unit,
-                            self.units[unit].script.srcpath()) )
+        closures = self._closures
+        if unit in closures:
+            return closures[unit]
+
+        active = set([unit])
+        stack = [(unit, iter(self._unituses(unit, parent)))]
+        while stack:
+            name, deps = stack[-1]
+            for dep in deps:
+                if dep in closures:
+                    continue
+                if dep in active:
+                    raise Errors.ConfigurationError(('Unit \'{0}\' defined in'
+                        ' \'{1}\' depends on itself through its use key.'
+                        ).format(dep, self.units[dep].script.srcpath()))
+                active.add(dep)
+                stack.append((dep, iter(self._unituses(dep, name))))
+                break
+            else:
+                stack.pop()
+                active.discard(name)
+                closures[name] = self._mergeclosures(
+                    self._unituses(name), name) + (name,)
+        return closures[unit]
 
-        unit_order.append(unit)
-        return unit_order
+    def _unituses(self, unit, parent=None):
+        """
+        Return the 'use' list of unit. parent is the unit which requires it,
+        for the error message if unit has not been defined.
+        """
+        try:
+            k = self.units[unit]._k
+        except KeyError:
+            raise Errors.ConfigurationError(('Unit \'{0}\''
+                ' required by \'{1}\' defined in \'{2}\' has not been'
+                ' defined.').format(unit, parent,
+                    self.units[parent].script.srcpath()))
+        if 'use' in k.keys():
+            return k.use('use') or []
+        return []
+
+    def _mergeclosures(self, names, parent, exclude=()):
+        """
+        Concatenate the closures of the units in names, required by unit
+        parent, dropping repeats and the units in exclude.
+        """
+        seen = set(exclude)
+        order = []
+        for name in names:
+            for u in self._unitclosure(name, parent):
+                if u not in seen:
+                    seen.add(u)
+                    order.append(u)
+        return tuple(order)
 
     def get_unit_deps(self, name):
         """
         Starting at unit 'name' generate two lists of deps in leaf first order
         """
-        synu_deps = self._buildunitdeps([], name)
+        synu_deps = self._unitclosure(name)
 
-        simu_deps = []
+        simu_deps = ()
         if 'tb_use' in self.units[name]._k.keys():
-            for tb_dep in self.units[name]._k.use('tb_use'):
-                simu_deps = self._buildunitdeps(simu_deps, tb_dep)
-        simu_deps = [u for u in simu_deps if u not in synu_deps]
+            simu_deps = self._mergeclosures(
+                self.units[name]._k.use('tb_use') or [], name, synu_deps)
 
-        return synu_deps, simu_deps
+        return list(synu_deps), list(simu_deps)
 
     def finalize(self):
         """
         If --check is not defined:
         1) Process the unit views' inheritance on the use and use_tb keys
         2) Search the unit tree from the top and build the dependency order
-            from --top_level unit for syn and sim using use and use_tb
-        3) Drop unused units from self.units to save memory and processing
+            from each --top_level unit for syn and sim using use and use_tb
+        3) Drop the units no top level uses to save memory and processing
         4) Process the unit views' inheritance on remaining keys
-        5) Pickle internal state where necessary and store to env['SFFUnits']
+        5) Write the project manifest, see SFFmanifest
+        6) Pack the units and store them in the unit database, see SFFunitdb
 
         if --check is defined:
         1) Check every view of every unit
@@ -167,73 +322,141 @@ class SFFUnitsCont():
 
         """
 
-        # Test the existence of the top_level unit key
-        try:
-            self.getunit(self.top_level)
-        except KeyError:
-            raise Errors.ConfigurationError(('Top Level "{0}" not'
-                ' found. Please re-run "waf configure --top_level= " with the'
-                ' correct top_level name or check the unit names and recurses'
-                ' in your wscript files.').format(self.top_level))
+        # Test the existence of the top_level unit keys
+        for top in self.top_levels:
+            try:
+                self.getunit(top)
+            except KeyError:
+                raise Errors.ConfigurationError(('Top Level "{0}" not'
+                    ' found. Please re-run "waf configure --top_level= " with'
+                    ' the correct top_level name or check the unit names and'
+                    ' recurses in your wscript files.').format(top))
 
         if self.check:
             self.ctx.msg('Option', '--check', color='BLUE')
             for m in self.units:
                 self.units[m].check_all()
 
-        # Apply inheritance on the use and tb_use directives
+        # With --incremental_configure take the keys of the units not
+        #  affected by a changed wscript from the previous configure
+        cache = self.conf_cache
+        affected = cache.affected(self.units, self.views)
+        full = {}
         for name,unit in self.units.items():
-            self.units[name].applyinheritance(self.views, ('use','tb_use'))
-
-        # Get the top_level unit dependencies from the use and tb_use keys
-        synu,simu = self.get_unit_deps(self.top_level)
-        self.synu_deps = synu
-        self.simu_deps = simu
+            if name not in affected:
+                (keys, full[name]) = cache.unit_keys(name)
+                unit.restorekeys(keys)
+        if cache.prev:
+            self.ctx.msg('Incremental configure', ('{0} of {1} wscripts '
+                'replayed, {2} of {3} units affected').format(
+                    len(cache.replayed), len(cache.scripts),
+                    len(affected.intersection(self.units)), len(self.units)),
+                color='BLUE')
+        self.ctx.msg('wscript code cache', SFFcodecache.summary(),
+            color='BLUE')
 
-        # Prune the SFFUnits dictionary to only syn and sim units
-        self.units = dict((k, self.units[k])
-             for k in simu + synu)
+        # Apply inheritance on the use and tb_use directives
+        for name,unit in self.units.items():
+            if name not in full:
+                self.units[name].applyinheritance(self.views, ('use','tb_use'))
+
+        # Get the top_level units dependencies from the use and tb_use keys
+        self._closures = cache.closures(affected)
+        for top in self.top_levels:
+            self.tops[top] = self.get_unit_deps(top)
+        (self.synu_deps, self.simu_deps) = self.tops[self.top_level]
+
+        # Prune the SFFUnits dictionary to the syn and sim units of the tops.
+        #  A unit shared by several tops is kept once so its library is
+        #  compiled once for all of them.
+        all_units = self.units
+        self.units = {}
+        for (synu, simu) in self.tops.values():
+            for k in simu + synu:
+                self.units[k] = all_units[k]
 
         # Apply inheritance on all keys
         for name,unit in self.units.items():
-            self.units[name].applyinheritance(self.views)
+            if not full.get(name):
+                self.units[name].applyinheritance(self.views)
 
         # Get and store the unit dependencies from the use and tb_use keys
         for name,unit in self.units.items():
             synu,simu = self.get_unit_deps(name)
             self.units[name].set_deps(self.getunit(synu), self.getunit(simu))
+        cache.save(all_units, self.units, self._closures, self.views)
+        del self._closures
 
-        self.ctx.msg('top_level set to', '{0}'.format(self.top_level),
-            color='BLUE')
-        self.ctx.msg('Units for simulation', '{0}'.format(self.simu_deps),
-            color='BLUE')
-        self.ctx.msg('Units for synthesis', '{0}'.format(self.synu_deps),
+        # Work out the include paths once the deps are known
+        for name,unit in self.units.items():
+            unit.set_includes()
+
+        self.ctx.msg('top_level set to', ', '.join(self.top_levels),
             color='BLUE')
+        for top in self.top_levels:
+            suffix = ' ({0})'.format(top) if len(self.top_levels) > 1 else ''
+            self.ctx.msg('Units for simulation' + suffix,
+                '{0}'.format(self.tops[top][1]), color='BLUE')
+            self.ctx.msg('Units for synthesis' + suffix,
+                '{0}'.format(self.tops[top][0]), color='BLUE')
+
+        (hashed, files) = SFFmanifest.write(self.ctx, self)
+        self.ctx.msg('Project manifest', '{0} ({1} of {2} files hashed)'
+            .format(SFFmanifest.FILENAME, hashed, files), color='BLUE')
 
         # Context contains one or more waflib.Nodes.Nod3 which cannot be
         #  pickled so we have to get rid of it. Also the configuration
         #  context is not valid in build etc.
         for m in self.units:
             self.units[m].pack()
-        env = self.ctx.env
+        db = self.ctx.cachedir.make_node(SFFunitdb.FILENAME).abspath()
+        SFFunitdb.write(db, self.units, {
+            'top_level': self.top_level,
+            'tops': self.tops,
+            'views': self.views})
+        self.ctx.env['SFF_UNITDB'] = db
         delattr(self,'ctx')
-        env['SFFUnits'] = pickle.dumps(self)
         self._packed = True
 
+    def load(self, db, tops=None):
+        """
+        Take the units from the SFFunitdb.UnitDB db, keeping only the ones
+        reachable from the top level, or from each of the top levels in the
+        list tops. They are unpacked when first used.
+        """
+        names = []
+        seen = set()
+        for top in [self.top_level] + list(tops or []):
+            try:
+                (synu, simu) = db.header['tops'][top]
+            except KeyError:
+                raise Errors.WafError(('Top Level "{0}" not found in {1}. '
+                    'Please re-run "waf configure".').format(top, db.path))
+            if top == self.top_level:
+                self.synu_deps = list(synu)
+                self.simu_deps = list(simu)
+            names.extend(n for n in simu + synu if n not in seen)
+            seen.update(simu + synu)
+        self.units = SFFunitdb.UnitIndex(db, names,
+            self._unpackunit, self._resolveunit)
+        self._packed = False
+
+    def _unpackunit(self, unit):
+        unit.unpack(self.ctx)
+
+    def _resolveunit(self, unit):
+        """Replace the dep names stored by SFFUnit.pack() with the units"""
+        unit.set_deps(self.getunit(unit.synu_deps),
+            self.getunit(unit.simu_deps))
+
     def unpack(self, ctx):
         self.ctx = ctx
         for name,unit in self.units.items():
             unit.unpack(ctx)
+        for name,unit in self.units.items():
+            self._resolveunit(unit)
         self._packed = False
 
-def load_SFFUnits(ctx):
-    new_SFFUnits = pickle.loads(ctx.env['SFFUnits'])
-    new_SFFUnits.ctx = ctx
-    for name,unit in new_SFFUnits.units.iteritems():
-        unit.unpack(ctx)
-    return new_SFFUnits
-
-
 @conf
 class SFFUnit:
     def __init__(self, ctx, *args, **kwargs):
@@ -264,6 +487,9 @@ class SFFUnit:
         self._check = False
         self.simu_deps = []
         self.synu_deps = []
+        #Transitive include paths, see set_includes()
+        self._incs = None
+        self._incargs = {}
 
         #Script that created us
         self.script = ctx.cur_script
@@ -352,6 +578,10 @@ class SFFUnit:
         self._k.pack()
         for view in self._v:
             self._v[view].pack()
+        self.synu_deps = [u.name for u in self.synu_deps]
+        self.simu_deps = [u.name for u in self.simu_deps]
+        self._incs = None
+        self._incargs = {}
         self._packed = True
 
     def unpack(self, ctx):
@@ -363,55 +593,106 @@ class SFFUnit:
         self._packed = False
 
     def use(self, key):
-        if key == 'includes':
-            nodes = set()
-            if self.synu_deps:
-                for u in self.synu_deps:
-                    nodes.update(u.use('_includes'))
-            if self.use('_includes'):
-                nodes.update(self.use('_includes'))
-            if nodes:
-                return nodes
-            else:
-                raise SFFerrors.Error("Key includes not set")
-        elif key == 'tb_includes':
-            nodes = set()
-            if self.simu_deps:
-                for u in self.simu_deps:
-                    nodes.update(u.use('_tb_includes'))
-            if self.use('_tb_includes'):
-                nodes.update(self.use('_tb_includes'))
-            if self.use('includes'):
-                nodes.update(self.use('includes'))
-            if nodes:
-                return nodes
-            else:
-                raise SFFerrors.Error("Key includes not set")
+        if key in ('includes', 'tb_includes'):
+            return self.incpath(key)[1]
         else:
             return self._k.use(key)
 
+    def set_includes(self):
+        """
+        Work out the transitive include paths of the unit from its deps,
+        which must be set and unpacked first:
+        includes: the _includes of the unit and every unit in synu_deps.
+        tb_includes: the _tb_includes of the unit and every unit in
+            simu_deps, then includes.
+        Each is kept in search order, the unit itself first and then its
+        deps nearest first, and as a frozenset for membership tests.
+        """
+        incs = _orderednodes(u._k.use('_includes')
+            for u in [self] + list(reversed(self.synu_deps)))
+        tb_incs = _orderednodes([self._k.use('_tb_includes')] +
+            [u._k.use('_tb_includes') for u in reversed(self.simu_deps)] +
+            [incs])
+        self._incs = {
+            'includes': (incs, frozenset(incs)),
+            'tb_includes': (tb_incs, frozenset(tb_incs))}
+        self._incargs = {}
+
+    def incpath(self, key):
+        """
+        Return (ordered tuple, frozenset) of the include nodes for key,
+        'includes' or 'tb_includes'.
+        """
+        if self._incs is None:
+            self.set_includes()
+        incs = self._incs[key]
+        if not incs[0]:
+            raise SFFerrors.Error("Key {0} not set".format(key))
+        return incs
+
+    def incdir_args(self, key, flag):
+        """
+        Return the include paths for key as a string of command line
+        arguments relative to the build directory, each preceded by flag.
+        e.g. flag '-incdir ' for Incisive or '+incdir+' for Modelsim. The
+        string is built once per unit and flag.
+        """
+        try:
+            return self._incargs[(key, flag)]
+        except KeyError:
+            args = ' '.join(flag + n.bldpath() for n in self.incpath(key)[0])
+            self._incargs[(key, flag)] = args
+            return args
+
     def get(self, key):
         return self._k.get(key)
 
     def add(self, key, thing):
         self._k.add(key, thing)
 
+    def restorekeys(self, keys):
+        """Set the keys after inheritance, recorded by a previous configure"""
+        self._k._k = dict(keys)
+        self._k.invalidate()
+
     def set_deps(self, synu, simu):
         self.synu_deps = synu
         self.simu_deps = simu
 
+def _orderednodes(groups):
+    """
+    Concatenate the node collections in groups into a tuple without
+    repeats. Sets are sorted by path so the order is the same every run.
+    """
+    seen = set()
+    order = []
+    for nodes in groups:
+        if isinstance(nodes, (set, frozenset)):
+            nodes = sorted(nodes, key=lambda n: n.abspath())
+        for n in nodes:
+            if n not in seen:
+                seen.add(n)
+                order.append(n)
+    return tuple(order)
+
 @conf
 class SFFView():
     """
     NEW PLAN:
     Hold the user settings from the file.
-    On-the-fly generate what is asked using those to drive the algo. Forget
-        caching them in dicts or anything like that.
+    On-the-fly generate what is asked using those to drive the algo.
+
+    The results of use() are cached per view for the run as resolving them
+    globs the source trees. The cache is cleared whenever the settings change
+    through add() or extend() and is never pickled. The globs themselves are
+    cached on the context so two views searching the same directory only
+    walk it once. Option --no-cache disables both for debugging.
     """
 
     def __init__(self, unit, **kwargs):
         self.unit = unit
         self._k = {}
+        self._cache = {}
 
         for key,val in kwargs.items():
             self._k[key] = SFFutil.strtolist(val)
@@ -440,11 +721,32 @@ class SFFView():
 
     def add(self, k, thing):
         self._k[k] = thing
+        self.invalidate()
 
     def extend(self, k, thing):
         self._k[k].extend(thing)
+        self.invalidate()
+
+    def invalidate(self):
+        """Drop the cached results of use() after the settings change."""
+        self._cache = {}
 
     def use(self, key):
+        """
+        Return the value of key, from the cache if possible. The caller gets
+        its own copy as some callers modify the result.
+        """
+        if Options.options.no_cache:
+            return self._use(key)
+        try:
+            val = self._cache[key]
+        except KeyError:
+            val = self._cache[key] = self._use(key)
+        if isinstance(val, (set, list)):
+            return type(val)(val)
+        return val
+
+    def _use(self, key):
         hdl_ext = []
         hdl_ext += self.unit.ctx.env.VLOG_EXT
         hdl_ext += self.unit.ctx.env.SVLOG_EXT
@@ -547,9 +849,7 @@ class SFFView():
         dirnodeswithsrc = set()
 
         for d in dirnodes:
-            new_files = []
-            for e in ext:
-                new_files += d.ant_glob('**/*{0}'.format(e))
+            new_files = self._globnodes(d, ext)
             for n in new_files:
                 filenodes.add(n)
             if new_files:
@@ -561,13 +861,28 @@ class SFFView():
 
         return filenodes,dirnodeswithsrc
 
+    def _globnodes(self, d, ext):
+        """
+        Glob directory node d for the extensions in ext. The result is kept
+        on the context so each directory tree is walked once per run.
+        """
+        ctx = self.unit.ctx
+        try:
+            globs = ctx.sff_glob_cache
+        except AttributeError:
+            globs = ctx.sff_glob_cache = {}
+        tup = (d, tuple(ext))
+        if Options.options.no_cache or tup not in globs:
+            globs[tup] = d.ant_glob(['**/*{0}'.format(e) for e in ext])
+        return list(globs[tup])
+
     def pack(self):
         delattr(self, 'unit')
-        pass #self.unit = self.unit.abspath()
+        self._cache = {}
 
     def unpack(self, unit):
         self.unit = unit
-        pass
+        self._cache = {}
 
 @conf
 def setup_hdl_module(self, *args, **kwargs):
@@ -575,14 +890,85 @@ def setup_hdl_module(self, *args, **kwargs):
                  'SFFUnits.add()'), color='YELLOW')
     self.SFFUnits.add(*args, **kwargs)
 
-def load_SFFUnits(ctx):
-    new_SFFUnits = pickle.loads(ctx.env['SFFUnits'])
-    new_SFFUnits.ctx = ctx
-    new_SFFUnits.unpack(ctx)
+@conf
+def load_SFFUnits(ctx, tops=None):
+    """
+    Return a SFFUnitsCont holding the units stored by configure in the unit
+    database, see SFFunitdb. tops is a list of top levels to load the units
+    of instead of the top level selected, each one must have been
+    configured. The first one becomes ctx.env.top_level.
+
+    When ctx has a dictionary sff_units_memo, as under waf watch, the
+    SFFUnitsCont loaded is kept in it by top levels and returned by the next
+    calls instead of loading the units again.
+    """
+    if tops:
+        for t in tops:
+            check_top_level(ctx, t)
+        top = ctx.env['top_level'] = tops[0]
+    else:
+        top = select_top_level(ctx)
+    extra = tuple(tops or ())[1:]
+    memo = getattr(ctx, 'sff_units_memo', None)
+    key = (top, extra)
+    if memo is not None and key in memo:
+        return memo[key]
+    new_SFFUnits = SFFUnitsCont(ctx)
+    new_SFFUnits.load(SFFunitdb.UnitDB(ctx.env['SFF_UNITDB']), extra)
+    if memo is not None:
+        memo[key] = new_SFFUnits
     return new_SFFUnits
 
+def check_top_level(ctx, top):
+    """Raise an error if top is not one of the top levels configured"""
+    tops = ctx.env['top_levels'] or [ctx.env['top_level']]
+    if top not in tops:
+        raise Errors.WafError(('Top Level "{0}" was not configured. Choose'
+            ' one of {1} or re-run "waf configure --top_level=" with it.'
+            ).format(top, ', '.join(tops)))
+
+def select_top_level(ctx):
+    """
+    Set ctx.env.top_level to the top level given by --top_level, which must
+    be one of the top levels configured. Defaults to the first one.
+    """
+    if not Options.options.top_level:
+        return ctx.env['top_level']
+    # A list, as given to configure in the same run, selects its first top
+    tops = SFFutil.strtolist(Options.options.top_level)
+    for top in tops:
+        check_top_level(ctx, top)
+    top = tops[0]
+    ctx.env['top_level'] = top
+    return top
+
 import re, sys, os
 def SFF_verilog_scan(task):
+    """
+    Scan a task for `include dependencies with the scanner selected by
+    configure --verilog_scanner. The native scanner runs in-process, the
+    vppreproc scanner forks the Veripool tool. The validate mode runs both,
+    warns about any difference and trusts vppreproc.
+    """
+    scanner = task.env['SFF_SCANNER'] or 'vppreproc'
+    if scanner == 'native':
+        return SFFpreproc.scan(task)
+
+    (nodes, names) = _vppreproc_scan(task)
+    if scanner == 'validate':
+        (nat_nodes, nat_names) = SFFpreproc.scan(task)
+        # vppreproc makes its nodes from the paths it prints, compare paths
+        paths = set(n.abspath() for n in nodes)
+        nat_paths = set(n.abspath() for n in nat_nodes)
+        missing = paths - nat_paths
+        extra = nat_paths - paths
+        if missing or extra:
+            Logs.warn(('SFF_verilog_scan: native scanner differs from '
+                'vppreproc for {0}. Missing: {1} Extra: {2}').format(
+                    task, sorted(missing), sorted(extra)))
+    return (nodes, names)
+
+def _vppreproc_scan(task):
     """
     scan for dependencies using the Veripool vppreprocessor tool.  Execute the
     preprocessor using the includes and collect the output. Then grep it for
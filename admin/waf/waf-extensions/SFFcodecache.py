@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Cache of the compiled wscripts, disabled with --no_code_cache.
+
+Context.load_module reads and compiles every wscript it loads, one per unit,
+for every command. It is replaced by a version keeping the code object of
+each wscript in build/c4che/DIRNAME<python version>/, one file per wscript
+named after the md5 of its path, in marshal format. The file also holds the
+key of the code: the path, modification time and size of the wscript and the
+Python version. While the key matches, the code is loaded from the file and
+the wscript is neither read nor parsed.
+
+The top level wscript is loaded before the SFF tools and is not cached.
+configure reports how many wscripts came from the cache and the time spent
+loading them; run it with --no_code_cache to compare.
+"""
+
+import imp
+import marshal
+import os
+import sys
+import time
+from waflib import Build
+from waflib import Context
+from waflib import Errors
+from waflib import Options
+from waflib import Utils
+
+DIRNAME = 'sffcode-'
+"""Prefix of the cache directory, followed by sys.hexversion in hex"""
+
+stats = {'hits': 0, 'compiled': 0, 'time': 0.0}
+"""wscripts loaded from the cache, wscripts compiled and seconds spent"""
+
+
+def cache_path(path):
+    """Return the path of the cache file of the wscript path, None if unset"""
+    if not Context.out_dir:
+        return None
+    return os.path.join(Context.out_dir, Build.CACHE_DIR, '%s%x' % (
+        DIRNAME, sys.hexversion), Utils.to_hex(Utils.md5(
+        path.encode()).digest()))
+
+def code_key(path):
+    st = os.stat(path)
+    return (path, st.st_mtime, st.st_size, sys.version)
+
+def read_code(cpath, key):
+    """Return the code in the cache file cpath if its key matches, or None"""
+    try:
+        with open(cpath, 'rb') as f:
+            (ckey, code) = marshal.load(f)
+    except Exception:
+        # Missing, truncated or written by another Python
+        return None
+    if tuple(ckey) != key:
+        return None
+    return code
+
+def write_code(cpath, key, code):
+    """Store code in the cache file cpath, ignoring the errors"""
+    tmp = '%s.%d.tmp' % (cpath, os.getpid())
+    try:
+        Utils.check_dir(os.path.dirname(cpath))
+        with open(tmp, 'wb') as f:
+            marshal.dump((key, code), f)
+        os.rename(tmp, cpath)
+    except (EnvironmentError, Errors.WafError, ValueError):
+        pass
+
+def get_code(path, encoding=None):
+    """Return the code object of the wscript path, compiling it if needed"""
+    try:
+        key = code_key(path)
+    except EnvironmentError:
+        raise Errors.WafError('Could not read the file %r' % path)
+    cpath = None
+    if not getattr(Options.options, 'no_code_cache', False):
+        cpath = cache_path(path)
+    if cpath:
+        code = read_code(cpath, key)
+        if code is not None:
+            stats['hits'] += 1
+            return code
+    try:
+        txt = Utils.readf(path, m='rU', encoding=encoding)
+    except EnvironmentError:
+        raise Errors.WafError('Could not read the file %r' % path)
+    code = compile(txt, path, 'exec')
+    stats['compiled'] += 1
+    if cpath:
+        write_code(cpath, key, code)
+    return code
+
+def load_module(path, encoding=None):
+    """Replacement for Context.load_module using the cache"""
+    try:
+        return Context.cache_modules[path]
+    except KeyError:
+        pass
+
+    start = time.time()
+    module = imp.new_module(Context.WSCRIPT_FILE)
+    code = get_code(path, encoding)
+    stats['time'] += time.time() - start
+
+    module_dir = os.path.dirname(path)
+    sys.path.insert(0, module_dir)
+    try:
+        exec(code, module.__dict__)
+    finally:
+        sys.path.remove(module_dir)
+
+    Context.cache_modules[path] = module
+    return module
+
+def summary():
+    """Return the statistics of the cache for configure to report"""
+    return '%d of %d wscripts cached, %.3fs' % (stats['hits'],
+        stats['hits'] + stats['compiled'], stats['time'])
+
+def install():
+    """Replace Context.load_module, once per process"""
+    if Context.load_module is not load_module:
+        Context.load_module = load_module
@@ -0,0 +1,206 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Incremental configure, selected with configure --incremental_configure.
+
+Every configure records, for each wscript below the top level one, its
+signature and the SFFUnits.add(), SFFUnits.addview() and ctx.recurse()
+calls it made, in order. The unit keys after inheritance and the unit
+dependency closures are recorded as well. All of it is stored in
+build/c4che/SFFconfig.cache.
+
+With --incremental_configure a wscript whose signature is unchanged is not
+executed: its recorded calls are replayed instead. Then:
+1) Inheritance is only applied to the units added or given views by the
+   scripts that were executed, the other units take their keys from the
+   previous configure.
+2) Only the dependency closures containing one of those units, or a unit
+   which no longer exists, are worked out again.
+A change to --views discards the recorded keys and closures.
+
+The wscripts of the units must only describe units. Anything else they do,
+such as setting ctx.env, is lost when they are replayed. The top level
+wscript is always executed.
+"""
+
+import os
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from waflib import Context
+from waflib import Logs
+from waflib import Utils
+
+VERSION = 1
+"""Bumped whenever the layout of the file changes"""
+
+FILENAME = 'SFFconfig.cache'
+"""Name of the file in the configuration cache directory"""
+
+
+class ConfCache(object):
+    """
+    Record the SFF calls made during a configure and replay the ones from
+    the previous configure. Created by SFFUnitsCont at configure time.
+    """
+    def __init__(self, ctx, incremental):
+        self.ctx = ctx
+        self.path = ctx.cachedir.make_node(FILENAME).abspath()
+        self.prev = self.load() if incremental else None
+        """Data stored by the previous configure, None if not used"""
+        self.scripts = {}
+        """Maps a wscript path to [signature, calls]"""
+        self.contrib = {}
+        """Maps a unit name to the set of wscripts that added or viewed it"""
+        self.executed = set()
+        """wscripts executed during this configure"""
+        self.replayed = set()
+        """wscripts replayed during this configure"""
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception:
+            Logs.debug('sffconf: no usable %s' % self.path)
+            return None
+        if data.get('version') != VERSION:
+            return None
+        return data
+
+    def record(self, method, args, kwargs, unit=None):
+        """
+        Record a call made by the script being executed or replayed. unit
+        is the name of the unit the call adds or views.
+        """
+        path = self.ctx.cur_script.abspath()
+        try:
+            calls = self.scripts[path][1]
+        except KeyError:
+            calls = []
+            self.scripts[path] = [None, calls]
+        calls.append((method, args, kwargs))
+        if unit is not None:
+            self.contrib.setdefault(unit, set()).add(path)
+
+    def recurse(self, dirs, name=None, mandatory=True, once=True,
+            encoding=None):
+        """
+        Replacement for ctx.recurse() in configure. Records the call and
+        replays each wscript found unchanged, otherwise hands the directory
+        to the real recurse.
+        """
+        ctx = self.ctx
+        for d in Utils.to_list(dirs):
+            if not os.path.isabs(d):
+                d = os.path.join(ctx.path.abspath(), d)
+            self.record('recurse', (d, name, mandatory, once), {})
+
+            wscript = os.path.join(d, Context.WSCRIPT_FILE)
+            node = None
+            if not name and not os.path.exists(wscript + '_' + ctx.fun):
+                node = ctx.root.find_node(wscript)
+            if node is None or not self.replay(node, once):
+                if node is not None:
+                    self.executed.add(node.abspath())
+                Context.Context.recurse(ctx, [d], name, mandatory, once,
+                    encoding)
+
+    def replay(self, node, once):
+        """
+        Replay the calls recorded for the script node if it is unchanged.
+        Returns False if the script must be executed.
+        """
+        path = node.abspath()
+        sig = Utils.h_file(path)
+        self.scripts.setdefault(path, [None, []])[0] = sig
+        if not self.prev:
+            return False
+        try:
+            (prev_sig, calls) = self.prev['scripts'][path]
+        except KeyError:
+            return False
+        if prev_sig != sig:
+            return False
+
+        ctx = self.ctx
+        tup = (node, ctx.fun)
+        if once and tup in ctx.recurse_cache:
+            return True
+        ctx.recurse_cache[tup] = True
+        self.replayed.add(path)
+        ctx.pre_recurse(node)
+        try:
+            for (method, args, kwargs) in calls:
+                if method == 'recurse':
+                    ctx.recurse(*args)
+                else:
+                    getattr(ctx.SFFUnits, method)(*args, **kwargs)
+        finally:
+            ctx.post_recurse(node)
+        return True
+
+    def affected(self, units, views):
+        """
+        Return the set of unit names whose keys must be worked out again:
+        those added or viewed by an executed script, those whose scripts
+        changed and those which disappeared. Every unit is affected if there
+        is no previous configure or the views changed.
+        """
+        if not self.prev or self.prev['views'] != views:
+            return set(units) | set(self.prev['units'] if self.prev else ())
+        ret = set(u for u in self.prev['units'] if u not in units)
+        for name in units:
+            contrib = self.contrib.get(name, set())
+            try:
+                prev_contrib = self.prev['units'][name][0]
+            except KeyError:
+                ret.add(name)
+                continue
+            if (contrib != set(prev_contrib) or
+                    contrib & self.executed or contrib - self.replayed):
+                ret.add(name)
+        return ret
+
+    def unit_keys(self, name):
+        """
+        Return (keys, full) recorded for unit name. keys is the dictionary
+        of the unit after inheritance, full is False if only the use and
+        tb_use keys were inherited.
+        """
+        return self.prev['units'][name][1:]
+
+    def closures(self, affected):
+        """
+        Return the recorded dependency closures that contain no affected
+        unit, see SFFUnitsCont._unitclosure.
+        """
+        if not self.prev:
+            return {}
+        return dict((name, cl) for (name, cl) in
+            self.prev['closures'].items()
+            if name not in affected and not affected.intersection(cl))
+
+    def save(self, units, full, closures, views):
+        """
+        Store the record of this configure. units holds every unit added,
+        full the names of the units which had inheritance applied to all
+        keys.
+        """
+        for path in self.executed:
+            if path in self.scripts and self.scripts[path][0] is None:
+                self.scripts[path][0] = Utils.h_file(path)
+        data = {
+            'version': VERSION,
+            'views': views,
+            'scripts': dict((path, tuple(v)) for (path, v) in
+                self.scripts.items() if v[0] is not None),
+            'units': dict((name, (tuple(sorted(self.contrib.get(name, ()))),
+                unit._k._k, name in full)) for (name, unit) in units.items()),
+            'closures': closures}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(data, f, 2)
+        os.rename(tmp, self.path)
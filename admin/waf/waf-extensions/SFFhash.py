@@ -0,0 +1,149 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+File hashing engine of the build commands, selected with --hash_algo and
+--hash_threads.
+
+Utils.h_file is replaced for the duration of the build by a version which
+maps the files of MMAP_MIN bytes or more in memory instead of reading them
+in chunks, and which uses the digest chosen with --hash_algo. md5, the
+default, gives the same signatures as waf. Changing the digest changes every
+signature, so everything is rebuilt once.
+
+With --hash_threads=N, each time the scheduler takes the next group of
+tasks, the signatures of their inputs and of the dependencies their scanners
+found in the previous build are computed by N threads before the first
+runnable_status() call. The digests release the interpreter lock, so the
+files are read and hashed concurrently, which pays off on NFS. The scheduler
+then finds the signatures in Node.cache_sig.
+
+Works with --stat_hash, see SFFstathash: the threads then only hash the files
+whose stat changed.
+"""
+
+import hashlib
+import mmap
+import os
+import threading
+from waflib import Errors
+from waflib import Logs
+from waflib import Options
+from waflib import Utils
+
+ALGOS = ('md5', 'sha1', 'blake2b')
+"""Choices for --hash_algo, blake2b needs Python 3.6 or later"""
+
+MMAP_MIN = 1 << 20
+"""Files of at least this size are mapped in memory to be hashed"""
+
+READ_SIZE = 200000
+"""Chunk size the smaller files are read in, as in Utils.h_file"""
+
+
+def digest(algo):
+    """Return a function returning a new hash object of algo"""
+    if algo == 'blake2b':
+        if not hasattr(hashlib, 'blake2b'):
+            raise Errors.WafError('--hash_algo=blake2b needs Python 3.6 or '
+                'later')
+        # As long as the md5 digests waf stores
+        return lambda: hashlib.blake2b(digest_size=16)
+    return getattr(hashlib, algo)
+
+def h_file_factory(new):
+    """Return a replacement for Utils.h_file hashing with new()"""
+    def h_file(fname):
+        m = new()
+        with open(fname, 'rb') as f:
+            if os.fstat(f.fileno()).st_size >= MMAP_MIN:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    m.update(mm)
+                finally:
+                    mm.close()
+            else:
+                while True:
+                    data = f.read(READ_SIZE)
+                    if not data:
+                        break
+                    m.update(data)
+        return m.digest()
+    return h_file
+
+def prewarm(nodes, threads):
+    """
+    Compute the signatures of the source nodes, which are left in
+    Node.cache_sig, with up to threads threads. Errors are left for the
+    tasks to report.
+    """
+    nodes = [n for n in nodes if not hasattr(n, 'cache_sig') and
+        (not n.is_bld() or n.ctx.bldnode is n.ctx.srcnode)]
+    if not nodes:
+        return
+    todo = iter(nodes)
+    lock = threading.Lock()
+    def work():
+        while True:
+            with lock:
+                node = next(todo, None)
+            if node is None:
+                return
+            try:
+                node.get_bld_sig()
+            except EnvironmentError:
+                pass
+    pool = [threading.Thread(target=work)
+        for i in range(min(threads, len(nodes)))]
+    for t in pool:
+        t.daemon = True
+        t.start()
+    for t in pool:
+        t.join()
+    Logs.debug('sffhash: prewarmed %d signatures' % len(nodes))
+
+def group_nodes(bld, tasks):
+    """Return the inputs and the previous scanner results of tasks"""
+    nodes = set()
+    for tsk in tasks:
+        nodes.update(getattr(tsk, 'inputs', []))
+        try:
+            nodes.update(bld.node_deps.get(tsk.uid(), []))
+        except AttributeError:
+            pass
+    return nodes
+
+def warm_iterator(bld, threads):
+    """
+    Wrap bld.get_build_iterator to prewarm the signatures of each group of
+    tasks when the scheduler takes it, once per group.
+    """
+    get_build_iterator = bld.get_build_iterator
+    def iterator():
+        for tasks in get_build_iterator():
+            prewarm(group_nodes(bld, tasks), threads)
+            yield tasks
+    return iterator
+
+def setup(bld):
+    """
+    Install the hashing engine in the build bld if --hash_algo or
+    --hash_threads was given. Must be called before the build runs.
+    """
+    algo = getattr(Options.options, 'hash_algo', 'md5') or 'md5'
+    threads = getattr(Options.options, 'hash_threads', 0) or 0
+    if (algo == 'md5' and not threads) or hasattr(bld, 'sff_hash_threads'):
+        return
+    bld.sff_hash_threads = threads
+    if threads:
+        bld.get_build_iterator = warm_iterator(bld, threads)
+    h_file = h_file_factory(digest(algo))
+    compile_ = bld.compile
+    def compile():
+        prev = Utils.h_file
+        Utils.h_file = h_file
+        try:
+            return compile_()
+        finally:
+            Utils.h_file = prev
+    bld.compile = compile
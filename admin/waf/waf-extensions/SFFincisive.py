@@ -27,6 +27,13 @@ import pickle
 import os,sys
 from SFFbuildmgr import SFF_verilog_scan
 from SFFbuildmgr import SFFUnitsCont, SFFUnit, SFFView, load_SFFUnits
+from SFFtask import SFFCompileTask, SFFSimTask, SFFElabTask
+from SFFtask import order_unit_tasks
+import SFFlibcache
+import SFFhash
+import SFFstathash
+import SFFtrace
+import SFFworkers
 
 def configure(ctx):
     """
@@ -36,6 +43,7 @@ def configure(ctx):
     ctx.find_program('ncvhdl')
     ctx.find_program('ncsim')
     ctx.find_program('ncelab')
+    ctx.env['NCVLOG_VERSION'] = SFFlibcache.tool_version(ctx, 'NCVLOG')
 
 def _simulate(ctx, gui):
     """
@@ -43,146 +51,200 @@ def _simulate(ctx, gui):
     Create the necessary tasks to build the simulation libs
     Create a toplevel CDS.lib and hdl.var with the mappings for all the
     libraries and deps.
-    Kick ncelab targetting the testbench
+    Kick ncelab targetting the testbench if the libraries changed
     Kick ncsim targetting the testbench
     """
     ctx.env['SFFUnits'] = load_SFFUnits(ctx)
+    top = ctx.env['SFFUnits'].getunit(ctx.env.top_level)
+
+    tb_tasks = build_libraries(ctx, [top])
+    elab = elaborate(ctx, top, tb_tasks[top.name], ctx.bldnode)
+    simulate(ctx, top, elab, ctx.bldnode, gui)
 
-    #units_taskgen(ctx)
+def build_libraries(ctx, tops):
     """
     Creates the directory path and nodes in the build directory.
-    Creates the testbench library separately
-    Creates a taskgen from each other library in units_hdl
+    Creates a compile task for each library used by the top level units
+    tops, once even if several of them use it, and one for the testbench
+    of each top.
+    Create the cds.lib and hdl.var in the toplevel of the build directory
+    with the first testbench as WORKLIB in hdl.var.
+    Returns a dictionary of top level name -> testbench compile task.
     """
+    SFFworkers.setup(ctx)
+    SFFtrace.setup(ctx)
+    SFFstathash.setup(ctx)
+    SFFhash.setup(ctx)
+    tasks = {}
+    tb_tasks = {}
+    for top in tops:
+        for u in top.synu_deps + top.simu_deps:
+            if u.name in tasks:
+                continue
+            lib = u.script.parent.get_bld().make_node(u.name+'_nclib')
+            lib.mkdir()
+            u.b['nclib'] = lib
 
-    top = ctx.env['SFFUnits'].getunit(ctx.env.top_level)
-
-    for u in top.synu_deps + top.simu_deps:
-        lib = u.script.parent.get_bld().make_node(u.name+'_nclib')
-        lib.mkdir()
-        u.b['nclib'] = lib
-
-        if u.use('use'):
-            tsk = IncisiveTask(
-                name=u.name,
-                target=lib,
-                source=u.use('src'),
-                includes=u.use('includes'),
-                after=u.use('use'),
-                output=lib,
-                scan=SFF_verilog_scan,
-                env=ctx.env)
-            ctx.add_to_group(tsk)
-        else:
             tsk = IncisiveTask(
                 name=u.name,
                 target=lib,
                 source=u.use('src'),
                 output=lib,
-                includes=u.use('includes'),
+                includes=u.incpath('includes')[0],
+                incargs=u.incdir_args('includes', '-incdir '),
                 scan=SFF_verilog_scan,
                 env=ctx.env)
             ctx.add_to_group(tsk)
-
-
+            tasks[u.name] = tsk
+
+        """
+        Create the testbench task last as it is always at the top dep
+        """
+        tb_lib = top.script.parent.get_bld().make_node(
+            top.use('tb')[0]+'_nclib')
+        tb_lib.mkdir()
+        top.b['tbnclib'] = tb_lib
+
+        tsk = IncisiveTask(
+            name=top.use('tb'),
+            target=tb_lib,
+            source=top.use('tb_src'),
+            output=tb_lib,
+            includes=top.incpath('tb_includes')[0],
+            incargs=top.incdir_args('tb_includes', '-incdir '),
+            scan=SFF_verilog_scan,
+            env=ctx.env )
+        ctx.add_to_group(tsk)
+        order_unit_tasks(top, tasks, tsk)
+        tb_tasks[top.name] = tsk
+
+    build_cds_lib_file(ctx, tops, ctx.bldnode.make_node('cds.lib'))
+    build_hdl_var_file(ctx, tops[0], ctx.bldnode.make_node('hdl.var'))
+    return tb_tasks
+
+def _run_flags(ctx, run_dir):
     """
-    Create the testbench taskgen last as it is always at the top dep
+    The tools find cds.lib and hdl.var in the build directory. Other run
+    directories get their own copies with absolute paths, passed by option.
     """
-    tb_lib = top.script.parent.get_bld().make_node(top.use('tb')[0]+'_nclib')
-    tb_lib.mkdir()
-    top.b['tbnclib'] = tb_lib
+    if run_dir is ctx.bldnode:
+        return ''
+    return '-cdslib %s -hdlvar %s' % (
+        run_dir.make_node('cds.lib').abspath(),
+        run_dir.make_node('hdl.var').abspath())
 
-    tsk = IncisiveTask(
-        name=top.use('tb'),
-        target=tb_lib,
-        source=top.use('tb_src'),
-        output=tb_lib,
-        includes=top.use('tb_includes'),
-        after=ctx.env.top_level,
-        scan=SFF_verilog_scan,
-        env=ctx.env )
+def elaborate(ctx, top, tb_task, run_dir):
+    """
+    Run ncelab on the testbench of top from directory run_dir once the
+    libraries are compiled. The snapshot is kept until a library, the
+    cds.lib, the hdl.var or the options change. Returns the task.
+    """
+    if run_dir is not ctx.bldnode:
+        run_dir.mkdir()
+        build_cds_lib_file(ctx, [top], run_dir.make_node('cds.lib'), True)
+        build_hdl_var_file(ctx, top, run_dir.make_node('hdl.var'), True)
+
+    tb = top.use('tb')[0]
+    tsk = SFFElabTask(
+        cmd='%s %s -timescale 1ns/10ps -access rwc %s' % (
+            ctx.env['NCELAB'][0], _run_flags(ctx, run_dir), tb),
+        cwd=run_dir,
+        libs=[u.b['nclib'] for u in top.synu_deps + top.simu_deps] +
+            [top.b['tbnclib']],
+        stamp=run_dir.make_node(tb + '.elab'),
+        files=[run_dir.make_node('cds.lib'), run_dir.make_node('hdl.var')],
+        dep_vars=['NCELAB'],
+        env=ctx.env)
     ctx.add_to_group(tsk)
+    tsk.set_run_after(tb_task)
+    return tsk
+
+def simulate(ctx, top, elab, run_dir, args, test=None, seed=None,
+        plusargs=()):
     """
-    Create the cds.lib and hdl.var in the toplevel of the build directory with
-    the testbench defined in cds.lib and as WORKLIB in hdl.var.
+    Run ncsim on the testbench of top after the elaboration task elab, from
+    directory run_dir with the options args. For a regression test is the
+    name of the test, seed and plusargs are given to the simulator.
+    Returns the task.
     """
-    build_cds_lib_file(ctx)
-    build_hdl_var_file(ctx)
+    opts = [args, _run_flags(ctx, elab.cwd)]
+    if seed is not None:
+        opts.append('-svseed %s' % seed)
+    opts.extend(plusargs)
+    tsk = SFFSimTask(
+        cmd='%s %s %s' % (ctx.env['NCSIM'][0], ' '.join(o for o in opts if o),
+            top.use('tb')[0]),
+        cwd=run_dir,
+        test=test,
+        env=ctx.env)
+    ctx.add_to_group(tsk)
+    tsk.set_run_after(elab)
+    return tsk
 
-    top = ctx.env['SFFUnits'].getunit(ctx.env.top_level)
-    #Run ncelab
-    ctx(name='ncelab',
-        rule='${NCELAB} -timescale ''1ns/10ps'' -access rwc %s' % top.use('tb')[0],
-        always = True,)
-
-    #Run ncsim
-    ctx(name='ncsim',
-        rule='${NCSIM} %s %s' % (gui,top.use('tb')[0]),
-        always = True,
-        after='ncelab')
-
-class IncisiveTask(Task.Task):
+class IncisiveTask(SFFCompileTask):
     def __init__(self, *k, **kw):
-        Task.Task.__init__(self, *k, **kw)
+        SFFCompileTask.__init__(self, *k, **kw)
 
         self.dep_vars = ['VLOG_EXT']
         self.dep_vars += ['VHDL_EXT']
         self.dep_vars += ['SVLOG_EXT']
         self.dep_vars += ['SDC_EXT']
+        self.dep_vars += ['NCVLOG_VERSION']
 
-        self.set_inputs(list(kw['source']))
-        self.set_outputs(kw['output'])
-        self.includes = kw['includes']
-        self.before = ['ncelab','ncsim']
-        from types import MethodType
-        self.scan = MethodType(kw['scan'],self)
+    def compile_cmd(self, srcs):
+        src = ''
+        for s in srcs:
+            src += s.bldpath() + ' '
+        return '%s -SV -linedebug -work %s %s %s' % (self.env['NCVLOG'][0],
+            self.outputs[0], self.incargs, src)
 
 
-    def __str__(self):
-        return '%s: %s\n' % (self.__class__.__name__,self.outputs[0])
+def _libpath(node, base, absolute):
+    if absolute:
+        return node.abspath()
+    return './' + node.path_from(base)
 
-    def run(self):
-        src = ''
-        for s in self.inputs:
-            src += s.bldpath() + ' '
-        tgt = self.outputs[0].bldpath()
-        incs = ''
-        if hasattr(self.generator,'includes'):
-            incs = ''
-            for inc in getattr(self.generator,'includes'):
-                incs += '-incdir ' + inc.bldpath() + ' '
-        res = ''
-        cmd = '%s -SV -linedebug -work %s %s %s' % (self.env['NCVLOG'][0], self.outputs[0],
-            incs, src)
-        return self.exec_command(cmd)
-
-
-def build_cds_lib_file(ctx):
-    top = ctx.env['SFFUnits'].getunit(ctx.env.top_level)
-    cds_lib = ctx.path.make_node('cds.lib').get_bld()
-    cds_lib.write('DEFINE {0} ./{1}\n'.format(top.b['tbnclib'],
-        top.b['tbnclib'].bldpath()))
-    for m in ctx.env['SFFUnits'].units:
-        md = ctx.env['SFFUnits'].getunit(m)
-        cds_lib.write('DEFINE {0} ./{1}\n'.format((md.b['nclib']),
-            md.b['nclib'].bldpath()), flags='a')
-
-def build_hdl_var_file(ctx):
-    top = ctx.env['SFFUnits'].getunit(ctx.env.top_level)
-    hdl_var = ctx.path.make_node('hdl.var').get_bld()
+def build_cds_lib_file(ctx, tops, cds_lib, absolute=False):
+    """
+    Write cds.lib to node cds_lib defining the testbench libraries of the
+    top level units tops and the library of every unit they use. The paths
+    are relative to the directory of cds_lib unless absolute is set.
+    """
+    base = cds_lib.parent
+    cds_lib.write('')
+    for top in tops:
+        cds_lib.write('DEFINE {0} {1}\n'.format(top.b['tbnclib'],
+            _libpath(top.b['tbnclib'], base, absolute)), flags='a')
+    for md in _units(tops):
+        cds_lib.write('DEFINE {0} {1}\n'.format((md.b['nclib']),
+            _libpath(md.b['nclib'], base, absolute)), flags='a')
+
+def _units(tops):
+    """Return the units used by the top level units tops, each once"""
+    units = []
+    for top in tops:
+        for u in top.synu_deps + top.simu_deps:
+            if u not in units:
+                units.append(u)
+    return units
+
+def build_hdl_var_file(ctx, top, hdl_var, absolute=False):
+    """
+    Write hdl.var to node hdl_var with the testbench of top as WORK and the
+    source directories of top and its units mapped to their libraries.
+    """
+    base = hdl_var.parent
     hdl_var.write('DEFINE WORK {0}\n'.format(top.b['tbnclib']))
     hdl_var.write('DEFINE LIB_MAP (\\\n', flags='a')
     tb_dir = top.use('tb_dir')
-    hdl_var.write('./{0}/... => {1}'.format(tb_dir.pop().bldpath(),
-         top.b['tbnclib']), flags='a')
+    hdl_var.write('{0}/... => {1}'.format(
+        _libpath(tb_dir.pop(), base, absolute), top.b['tbnclib']), flags='a')
     if tb_dir:
         for d in tb_dir:
-            hdl_var.write(',\\\n./{0}/... => {1}'.format(d.bldpath(),
-                top.b['nclib']), flags='a')
-    for m in ctx.env['SFFUnits'].units:
-        md = ctx.env['SFFUnits'].getunit(m)
+            hdl_var.write(',\\\n{0}/... => {1}'.format(
+                _libpath(d, base, absolute), top.b['nclib']), flags='a')
+    for md in top.synu_deps + top.simu_deps:
         for d in md.use('src_dir'):
-            hdl_var.write(',\\\n./{0}/... => {1}'.format(d.bldpath(),
-                md.b['nclib']), flags='a')
+            hdl_var.write(',\\\n{0}/... => {1}'.format(
+                _libpath(d, base, absolute), md.b['nclib']), flags='a')
     hdl_var.write(')\n', flags='a')
-
@@ -0,0 +1,129 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Content-addressed cache of the compiled simulator libraries, modelled on the
+hooks of waflib/extras/netcache_client.py but without a server: the cache is
+a directory, local or on NFS, named by the environment variable ENV_VAR.
+
+The key of a library covers the signature of its compile task (the contents
+of the sources and of the files they `include, the tool version and the
+dep_vars) and the paths, relative to the build directory, of the library,
+the sources and the include directories, as the tools record them in the
+library. Two checkouts with the same layout therefore share entries. It also
+covers the keys of the libraries of the units used, which the tools compile
+against (vlog -L), so a library is not restored after a package it imports
+changed.
+
+Each library is stored as a copy of its directory in <cache>/<xx>/<key>,
+where xx are the first two characters of the key. Entries are written to a
+temporary directory and renamed into place, so concurrent builds never see
+a partial library. Nothing is ever evicted, the directory can be cleared at
+any time.
+
+Errors reading or writing the cache are logged and ignored, the library is
+then compiled as usual.
+"""
+
+import os
+import shutil
+from waflib import Context
+from waflib import Errors
+from waflib import Logs
+from waflib import Utils
+
+ENV_VAR = 'SFF_LIB_CACHE'
+"""Environment variable holding the cache directory, unset to disable it"""
+
+
+def cache_dir():
+    """Return the cache directory or None if the cache is disabled"""
+    return os.environ.get(ENV_VAR) or None
+
+def tool_version(ctx, var):
+    """
+    Return the version reported by the tool ctx.env[var] with -version, for
+    the dep_vars of the tasks running it. Empty if the tool reports none.
+    """
+    try:
+        return ctx.cmd_and_log(ctx.env[var] + ['-version'],
+            quiet=Context.BOTH).strip()
+    except Errors.WafError:
+        return ''
+
+def key(task):
+    """Return the cache key of a compile task as a hexadecimal string"""
+    try:
+        return task.sff_lib_key
+    except AttributeError:
+        pass
+    from SFFtask import SFFCompileTask
+    bld = task.generator.bld
+    m = Utils.md5()
+    m.update(task.__class__.__name__.encode())
+    m.update(task.signature())
+    m.update(task.outputs[0].path_from(bld.bldnode).encode())
+    for node in task.inputs:
+        m.update(node.path_from(bld.bldnode).encode())
+    m.update(task.incargs.encode())
+    m.update(getattr(task, 'libargs', '').encode())
+    deps = [t for t in task.run_after if isinstance(t, SFFCompileTask)]
+    for dep in sorted(deps, key=lambda t: t.outputs[0].abspath()):
+        m.update(key(dep).encode())
+    task.sff_lib_key = Utils.to_hex(m.digest())
+    return task.sff_lib_key
+
+def entry(task):
+    """Return the path of the cache entry of task or None if disabled"""
+    path = cache_dir()
+    if not path:
+        return None
+    k = key(task)
+    return os.path.join(path, k[:2], k)
+
+def _copytree(src, dst):
+    """Copy the directory src to dst through a temporary directory"""
+    tmp = '%s.%d.tmp' % (dst, os.getpid())
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    shutil.copytree(src, tmp, symlinks=True)
+    try:
+        os.rename(tmp, dst)
+    except OSError:
+        # Another build stored the same entry first
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(dst):
+            raise
+
+def retrieve(task):
+    """
+    Replace the library of task by the cached copy. Returns True on a hit.
+    """
+    path = entry(task)
+    if not path or not os.path.isdir(path):
+        return False
+    lib = task.outputs[0].abspath()
+    try:
+        if os.path.isdir(lib):
+            shutil.rmtree(lib)
+        _copytree(path, lib)
+    except EnvironmentError as e:
+        Logs.warn('Could not restore %s from the library cache: %s' % (
+            task.outputs[0].name, e))
+        return False
+    Logs.debug('sfflibcache: restored %s from %s' % (lib, path))
+    return True
+
+def store(task):
+    """Copy the library of task to the cache unless it is there already"""
+    path = entry(task)
+    if not path or os.path.isdir(path):
+        return
+    try:
+        Utils.check_dir(os.path.dirname(path))
+        _copytree(task.outputs[0].abspath(), path)
+    except (EnvironmentError, Errors.WafError) as e:
+        Logs.warn('Could not store %s in the library cache: %s' % (
+            task.outputs[0].name, e))
+        return
+    Logs.debug('sfflibcache: stored %s in %s' % (task.outputs[0], path))
@@ -0,0 +1,118 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+JSON manifest of the configured project, written by configure to
+build/SFFmanifest.json for external tools (lint, CDC, synthesis...) to load
+the design without running waf.
+
+Layout, every path relative to the top level directory:
+{
+  "version": VERSION,
+  "top_levels": [unit, ...],
+  "views": [view, ...],
+  "tops": {unit: {"synu_deps": [unit, ...], "simu_deps": [unit, ...]}},
+  "units": {unit: {"script": path, "use": [...], "tb_use": [...],
+      "synu_deps": [...], "simu_deps": [...], "src": [...],
+      "src_dir": [...], "includes": [...], "tb": name, "tb_src": [...],
+      "tb_dir": [...], "tb_includes": [...]}},
+  "files": {path: {"md5": hex, "size": bytes, "mtime": seconds}}
+}
+The deps are in compile order, leaf first, and the includes in search
+order. "files" holds every source and testbench source.
+
+Only the files whose size or modification time changed since the previous
+manifest are hashed again, and the manifest is only rewritten when its
+content changes.
+"""
+
+import json
+import os
+from waflib import Utils
+import SFFerrors
+import SFFutil
+
+VERSION = 1
+"""Bumped whenever the layout changes"""
+
+FILENAME = 'SFFmanifest.json'
+"""Name of the manifest in the build directory"""
+
+SET_KEYS = ('src', 'src_dir', 'tb_src', 'tb_dir')
+"""Keys holding a set of nodes, written sorted"""
+
+
+def _load(path):
+    """Return the files of the manifest at path, empty if unusable"""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (EnvironmentError, ValueError):
+        return {}
+    if data.get('version') != VERSION:
+        return {}
+    return data.get('files', {})
+
+def _unitentry(unit):
+    """Return the manifest entry of a unit"""
+    entry = {
+        'script': unit.script.srcpath(),
+        'use': list(unit.use('use') or []),
+        'tb_use': list(unit.use('tb_use') or []),
+        'synu_deps': [u.name for u in unit.synu_deps],
+        'simu_deps': [u.name for u in unit.simu_deps],
+        'tb': unit.use('tb')[0]}
+    for key in SET_KEYS:
+        try:
+            entry[key] = sorted(n.srcpath() for n in unit.use(key))
+        except SFFerrors.Error:
+            entry[key] = []
+    for key in ('includes', 'tb_includes'):
+        try:
+            entry[key] = [n.srcpath() for n in unit.incpath(key)[0]]
+        except SFFerrors.Error:
+            entry[key] = []
+    return entry
+
+def write(ctx, cont):
+    """
+    Write the manifest of the finalized SFFUnitsCont cont before its units
+    are packed. Returns (hashed, files), the number of files hashed again
+    and the number listed.
+    """
+    node = ctx.bldnode.make_node(FILENAME)
+    prev = _load(node.abspath())
+
+    units = {}
+    files = {}
+    hashed = 0
+    for name in cont.units:
+        unit = cont.units[name]
+        entry = units[name] = _unitentry(unit)
+        for key in ('src', 'tb_src'):
+            for n in unit.use(key):
+                path = n.srcpath()
+                if path in files:
+                    continue
+                st = os.stat(n.abspath())
+                old = prev.get(path)
+                if (old and old['size'] == st.st_size and
+                        old['mtime'] == st.st_mtime):
+                    files[path] = old
+                    continue
+                files[path] = {'md5': Utils.to_hex(Utils.h_file(n.abspath())),
+                    'size': st.st_size, 'mtime': st.st_mtime}
+                hashed += 1
+
+    data = {
+        'version': VERSION,
+        'top_levels': list(cont.top_levels),
+        'views': list(cont.views),
+        'tops': dict((top, {'synu_deps': list(synu),
+            'simu_deps': list(simu)})
+            for (top, (synu, simu)) in cont.tops.items()),
+        'units': units,
+        'files': files}
+    SFFutil.write_if_changed(node, json.dumps(data, sort_keys=True,
+        separators=(',', ':')) + '\n')
+    return (hashed, len(files))
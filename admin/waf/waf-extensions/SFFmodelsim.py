@@ -20,8 +20,19 @@ from waflib.Configure import conf
 from waflib.TaskGen import feature, before_method, after_method
 import pickle
 import os,sys
+import shutil
 from SFFbuildmgr import SFF_verilog_scan
 from SFFbuildmgr import SFFUnitsCont, SFFUnit, SFFView, load_SFFUnits
+from SFFtask import SFFCompileTask, SFFSimTask, SFFElabTask
+from SFFtask import order_unit_tasks
+import SFFlibcache
+import SFFhash
+import SFFstathash
+import SFFtrace
+import SFFworkers
+
+MODELSIM_INI = 'modelsim.ini'
+"""Library mappings generated in the build directory"""
 
 def configure(ctx):
     """
@@ -31,105 +42,208 @@ def configure(ctx):
     ctx.find_program('vcom')
     ctx.find_program('vlib')
     ctx.find_program('vsim')
+    ctx.find_program('vopt')
+    ctx.env['VLOG_VERSION'] = SFFlibcache.tool_version(ctx, 'VLOG')
 
 def _simulate(ctx, gui):
     """
     Load the SFFUnits into the system.
     Create the necessary tasks to build the simulation libs
-    Kick vsim targetting the testbench
+    Kick vopt targetting the testbench if the libraries changed
+    Kick vsim targetting the optimized testbench
     """
     ctx.env['SFFUnits'] = load_SFFUnits(ctx)
+    top = ctx.env['SFFUnits'].getunit(ctx.env.top_level)
+
+    tb_tasks = build_libraries(ctx, [top])
+    elab = elaborate(ctx, top, tb_tasks[top.name], ctx.bldnode)
+    simulate(ctx, top, elab, ctx.bldnode, gui)
 
+def build_libraries(ctx, tops):
     """
     Creates the directory path and nodes in the build directory.
-    Creates a taskgen from each other library in units_hdl
+    Creates a compile task for each library used by the top level units
+    tops, once even if several of them use it, and one for the testbench
+    of each top. Each unit gets its own library <unit>_vlib and is compiled
+    with -L for the libraries of its deps.
+    Create the modelsim.ini in the toplevel of the build directory mapping
+    every library name to its directory.
+    Returns a dictionary of top level name -> testbench compile task.
     """
+    SFFworkers.setup(ctx)
+    SFFtrace.setup(ctx)
+    SFFstathash.setup(ctx)
+    SFFhash.setup(ctx)
+    tasks = {}
+    tb_tasks = {}
+    for top in tops:
+        for u in top.synu_deps + top.simu_deps:
+            if u.name in tasks:
+                continue
+            u.b['vlib'] = u.script.parent.get_bld().make_node(
+                u.name+'_vlib')
+            u.b['vlib'].parent.mkdir()
 
-    top = ctx.env['SFFUnits'].getunit(ctx.env.top_level)
-
-    for u in top.synu_deps + top.simu_deps:
-        lib = u.script.parent.get_bld().make_node('work_vlib')
-        lib.mkdir()
-        u.b['vlib'] = lib
-
-        if u.use('use'):
             tsk = ModelsimTask(
                 name=u.name,
-                target=lib,
+                target=u.b['vlib'],
                 source=u.use('src'),
-                includes=u.use('includes'),
-                after=u.use('use'),
-                output=lib,
+                output=u.b['vlib'],
+                includes=u.incpath('includes')[0],
+                incargs=u.incdir_args('includes', '+incdir+'),
+                libargs=_lib_args(d for d in reversed(u.synu_deps)
+                    if d is not u),
                 scan=SFF_verilog_scan,
                 env=ctx.env)
             ctx.add_to_group(tsk)
-        else:
-            tsk = ModelsimTask(
-                name=u.name,
-                target=lib,
-                source=u.use('src'),
-                output=lib,
-                includes=u.use('includes'),
-                scan=SFF_verilog_scan,
-                env=ctx.env)
-            ctx.add_to_group(tsk)
-
+            tasks[u.name] = tsk
+
+        """
+        Create the testbench task last as it is always at the top dep
+        """
+        top.b['tbvlib'] = top.script.parent.get_bld().make_node(
+            top.use('tb')[0]+'_vlib')
+        top.b['tbvlib'].parent.mkdir()
+
+        tsk = ModelsimTask(
+            name=top.use('tb'),
+            target=top.b['tbvlib'],
+            source=top.use('tb_src'),
+            output=top.b['tbvlib'],
+            includes=top.incpath('tb_includes')[0],
+            incargs=top.incdir_args('tb_includes', '+incdir+'),
+            libargs=_tb_lib_args(top),
+            scan=SFF_verilog_scan,
+            env=ctx.env )
+        ctx.add_to_group(tsk)
+        order_unit_tasks(top, tasks, tsk)
+        tb_tasks[top.name] = tsk
+
+    build_modelsim_ini(ctx, tops, ctx.bldnode.make_node(MODELSIM_INI))
+    return tb_tasks
+
+def _lib_args(units):
+    """Return the -L arguments searching the libraries of units in order"""
+    return ' '.join('-L %s' % u.b['vlib'] for u in units)
+
+def _tb_lib_args(top):
+    """
+    Return the -L arguments for the testbench of top: the libraries of the
+    units it uses, nearest first.
+    """
+    units = []
+    for u in reversed(top.simu_deps + top.synu_deps):
+        if u not in units:
+            units.append(u)
+    return _lib_args(units)
 
+def build_modelsim_ini(ctx, tops, ini):
+    """
+    Write the modelsim.ini node ini mapping the testbench libraries of the
+    top level units tops and the library of every unit they use to their
+    absolute paths, so the tools find them from any directory. The standard
+    libraries come from the modelsim.ini of the installation.
     """
-    Create the testbench taskgen last as it is always at the top dep
+    lines = ['[Library]', 'others = $MODEL_TECH/../modelsim.ini']
+    seen = set()
+    for top in tops:
+        lines.append('{0} = {1}'.format(top.b['tbvlib'],
+            top.b['tbvlib'].abspath()))
+    for top in tops:
+        for md in top.synu_deps + top.simu_deps:
+            if md.name in seen:
+                continue
+            seen.add(md.name)
+            lines.append('{0} = {1}'.format(md.b['vlib'],
+                md.b['vlib'].abspath()))
+    ini.write('\n'.join(lines) + '\n')
+
+def _ini_flags(ctx, run_dir):
     """
-    ctx.add_group()
-    tb_lib = top.script.parent.get_bld().make_node('work_vlib')
-    tb_lib.mkdir()
-    top.b['tbvlib'] = tb_lib
+    The tools find modelsim.ini in the build directory. Other run
+    directories are given it by option.
+    """
+    if run_dir is ctx.bldnode:
+        return ''
+    return '-modelsimini %s' % ctx.bldnode.make_node(MODELSIM_INI).abspath()
 
-    tsk = ModelsimTask(
-        name=top.use('tb'),
-        target=tb_lib,
-        source=top.use('tb_src'),
-        output=tb_lib,
-        includes=top.use('tb_includes'),
-        after=ctx.env.top_level,
-        scan=SFF_verilog_scan,
-        env=ctx.env )
+def elaborate(ctx, top, tb_task, run_dir):
+    """
+    Run vopt on the testbench of top once the libraries are compiled,
+    writing the optimized design <tb>_opt to the testbench library. It is
+    kept until a library, the modelsim.ini or the options change. vopt runs
+    from the build directory like vlog, the stamp is written to run_dir.
+    Returns the task.
+    """
+    run_dir.mkdir()
+    tb = top.use('tb')[0]
+    tsk = SFFElabTask(
+        cmd='%s +acc -work %s %s %s -o %s_opt' % (ctx.env['VOPT'][0],
+            top.b['tbvlib'], _tb_lib_args(top), tb, tb),
+        cwd=ctx.bldnode,
+        libs=[u.b['vlib'] for u in top.synu_deps + top.simu_deps] +
+            [top.b['tbvlib']],
+        stamp=run_dir.make_node(tb + '.elab'),
+        files=[ctx.bldnode.make_node(MODELSIM_INI)],
+        dep_vars=['VOPT'],
+        env=ctx.env)
     ctx.add_to_group(tsk)
-    ctx.add_group()
+    tsk.set_run_after(tb_task)
+    return tsk
 
+def simulate(ctx, top, elab, run_dir, args, test=None, seed=None,
+        plusargs=()):
     """
-    Run the Modelsim command with gui options provided.
+    Run vsim on the optimized testbench of top after the elaboration task
+    elab, from directory run_dir with the options args. For a regression
+    test is the name of the test, seed and plusargs are given to the
+    simulator. Returns the task.
     """
-    ##Run vsim
-    ctx(name='vsim',
-        rule='vsim %s -lib %s %s' % (gui,top.b['tbvlib'], top.use('tb')[0]),
-        always = True)
+    opts = [args, _ini_flags(ctx, run_dir), '-lib %s' % top.b['tbvlib']]
+    if seed is not None:
+        opts.append('-sv_seed %s' % seed)
+    opts.extend(plusargs)
+    tsk = SFFSimTask(
+        cmd='%s %s %s_opt' % (ctx.env['VSIM'][0],
+            ' '.join(o for o in opts if o), top.use('tb')[0]),
+        cwd=run_dir,
+        test=test,
+        env=ctx.env)
+    ctx.add_to_group(tsk)
+    tsk.set_run_after(elab)
+    return tsk
 
-class ModelsimTask(Task.Task):
+class ModelsimTask(SFFCompileTask):
     def __init__(self, *k, **kw):
-        Task.Task.__init__(self, *k, **kw)
+        SFFCompileTask.__init__(self, *k, **kw)
+
+        self.libargs = kw.get('libargs', '')
+        """-L arguments for the libraries of the deps"""
+        self.dep_vars = ['VLOG_VERSION']
 
-        self.set_inputs(list(kw['source']))
-        self.set_outputs(kw['output'])
-        self.includes = kw['includes']
-        self.before = ['ncelab','ncsim']
-        from types import MethodType
-        self.scan = MethodType(kw['scan'],self)
+    def sig_vars(self):
+        SFFCompileTask.sig_vars(self)
+        self.m.update(self.libargs.encode())
+        return self.m.digest()
 
+    def flags_sig(self):
+        m = Utils.md5()
+        m.update(SFFCompileTask.flags_sig(self))
+        m.update(self.libargs.encode())
+        return m.digest()
 
-    def __str__(self):
-        return '%s: %s\n' % (self.__class__.__name__,self.outputs[0])
+    def clean_library(self):
+        """Delete the library, compile_cmd creates it again with vlib."""
+        shutil.rmtree(self.outputs[0].abspath())
 
-    def run(self):
+    def compile_cmd(self, srcs):
         src = ''
-        for s in self.inputs:
+        for s in srcs:
             src += s.bldpath() + ' '
-        tgt = self.outputs[0].bldpath()
-        incs = ''
-        if hasattr(self.generator,'includes'):
-            incs = ''
-            for inc in getattr(self.generator,'includes'):
-                incs += '+incdir+' + inc.bldpath() + ' '
-        res = ''
-        cmd_setup = 'vlib %s; ' % (self.outputs[0])
-        cmd = '%s vlog -sv -work %s %s %s' % (cmd_setup, self.outputs[0],
-            incs, src)
-        return self.exec_command(cmd)
+        lib = self.outputs[0]
+        # The library name is mapped by modelsim.ini, only create it once
+        cmd_setup = ''
+        if not os.path.isdir(lib.abspath()):
+            cmd_setup = '%s %s; ' % (self.env['VLIB'][0], lib.bldpath())
+        return '%s%s -sv -work %s %s %s %s' % (cmd_setup, self.env['VLOG'][0],
+            lib, self.libargs, self.incargs, src)
@@ -0,0 +1,353 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Verilog/SystemVerilog preprocessor for finding `include dependencies without
+running an external tool. Modelled on waflib.Tools.c_preproc.
+
+Only the directives which change the set of included files are interpreted:
+`include, `define, `undef, `undefineall, `ifdef, `ifndef, `elsif, `else and
+`endif. Macro bodies are not expanded except to resolve `include `MACRO.
+
+Include files are searched for in the order used by the simulators:
+1) Absolute paths are used as is.
+2) Relative to the directory the tools run in (the build directory).
+3) Each +incdir/-incdir in the order given.
+
+The directives of each file are kept in bld.sff_cache['scan'], which is
+stored in the build database. Entries are keyed by the file path and hold the
+file signature, so only files whose content changed are read again. The files
+the includes resolve to are only kept for the current build, per include path
+list, as a file added to an earlier directory of the list shadows the one
+found before.
+"""
+
+import re
+import os
+from waflib import Logs, Utils, Errors
+
+
+class PreprocError(Errors.WafError):
+    pass
+
+recursion_limit = 150
+"""Limit on the depth of nested `include files"""
+
+re_nl = re.compile(r'\\\r*\n', re.MULTILINE)
+"""Match line continuations, used in multi-line `define"""
+
+re_comments = re.compile(r'//.*?$|/\*.*?\*/|"(?:\\.|[^\\"\n])*"',
+    re.DOTALL | re.MULTILINE)
+"""Match comments and strings. Strings are kept, comments are removed."""
+
+re_directives = re.compile(
+    r'`(?:(?P<cond>ifdef|ifndef|elsif|undef)[ \t]+(?P<macro>[a-zA-Z_]\w*)'
+    r'|(?P<bare>else|endif|undefineall)\b'
+    r'|include[ \t]*(?P<inc>"[^"\n]*"|<[^>\n]*>|`[a-zA-Z_]\w*)'
+    r'|define[ \t]+(?P<define>[a-zA-Z_]\w*)(?P<value>[^\n]*))',
+    re.MULTILINE)
+"""Match the directives of interest anywhere in a line"""
+
+re_uses = re.compile(r'`([a-zA-Z_]\w*)')
+"""Match every macro reference, directives included"""
+
+re_package = re.compile(
+    r'^[ \t]*package[ \t]+(?:(?:static|automatic)[ \t]+)?([a-zA-Z_]\w*)[ \t]*;',
+    re.MULTILINE)
+"""Match the declaration of a SystemVerilog package"""
+
+accepted = 'a'
+"""Parser state is *accepted*"""
+
+ignored = 'i'
+"""Parser state is *ignored*, for example an `ifdef of an undefined macro"""
+
+skipped = 's'
+"""Parser state is *skipped*, a previous branch of the `ifdef was taken"""
+
+def repl(m):
+    """Replace comments by a space and leave strings untouched"""
+    s = m.group(0)
+    if s.startswith('/'):
+        return ' '
+    return s
+
+def filter_directives(filename):
+    """
+    Read a Verilog file and return its preprocessor directives as a list of
+    (keyword, argument) tuples. For `define the argument is (name, value).
+    The list ends with ('package', names) holding the packages the file
+    declares and ('uses', names) holding every `name in the file.
+    """
+    code = Utils.readf(filename)
+    code = re_nl.sub('', code)
+    code = re_comments.sub(repl, code)
+    lst = []
+    for m in re_directives.finditer(code):
+        if m.group('cond'):
+            lst.append((m.group('cond'), m.group('macro')))
+        elif m.group('bare'):
+            lst.append((m.group('bare'), ''))
+        elif m.group('inc'):
+            lst.append(('include', m.group('inc')))
+        else:
+            lst.append(('define', (m.group('define'),
+                m.group('value').strip())))
+    lst.append(('package', tuple(re_package.findall(code))))
+    lst.append(('uses', tuple(sorted(set(re_uses.findall(code))))))
+    return lst
+
+def extract_include(txt, defs):
+    """
+    Return the file name from an `include argument. Handles "file", <file>
+    and `MACRO where the macro expands to either of the former.
+    """
+    if txt[0] == '`':
+        txt = defs.get(txt[1:], '').strip()
+        if not txt:
+            return None
+    if txt[0] in '"<' and len(txt) > 1 and txt[-1] in '">':
+        return txt[1:-1]
+    return None
+
+
+class verilog_parser(object):
+    """
+    Used by :py:func:`SFFpreproc.scan` to parse Verilog files. A single
+    parser is used for all the files of a task as `defines persist across
+    the files of one compiler invocation.
+    """
+    def __init__(self, cwd, nodepaths=None, defines=None):
+        self.defs = dict(defines or {})
+        self.cwd = cwd
+        """Directory the compiler runs in, searched before the includes"""
+        self.nodepaths = nodepaths or []
+        """Include paths in the order they are passed to the compiler"""
+        self.nodes = []
+        """List of included nodes found so far"""
+        self.names = []
+        """List of include names that could not be found"""
+        self.seen = set()
+        self.parse_cache = {}
+        """Maps a file path to (signature, directives)"""
+        self.incdirs_key = tuple(n.abspath() for n in [cwd] + self.nodepaths)
+        """Key the resolved includes are stored under for the build"""
+        self.edges = {}
+        """Maps an include name to the node it resolved to"""
+        self.defines_cache = {}
+        """Maps a header node to the macros it may define"""
+
+    def cached_find_resource(self, node, filename):
+        """Find a file from a directory, caching the result on the context"""
+        try:
+            nd = node.ctx.sff_cache_nd
+        except AttributeError:
+            nd = node.ctx.sff_cache_nd = {}
+
+        tup = (node, filename)
+        try:
+            return nd[tup]
+        except KeyError:
+            ret = node.find_resource(filename)
+            nd[tup] = ret
+            return ret
+
+    def tryfind(self, filename):
+        """
+        Search for an included file in the order described at the top of
+        this module. Returns the node or None. Files resolved previously for
+        the same include paths in this build are looked up in edges first.
+        """
+        try:
+            return self.edges[filename]
+        except KeyError:
+            pass
+
+        if os.path.isabs(filename):
+            found = self.cwd.ctx.root.find_resource(filename)
+        else:
+            found = self.cached_find_resource(self.cwd, filename)
+            for n in self.nodepaths:
+                if found:
+                    break
+                found = self.cached_find_resource(n, filename)
+        if found:
+            self.edges[filename] = found
+        return found
+
+    def directives(self, node):
+        """
+        Return the directives of a file. Each file is only parsed when its
+        signature changes.
+        """
+        filepath = node.abspath()
+        try:
+            sig = node.get_bld_sig()
+        except EnvironmentError:
+            raise PreprocError('could not read the file %s' % filepath)
+
+        try:
+            (prev_sig, lst) = self.parse_cache[filepath]
+        except (KeyError, ValueError):
+            # Not scanned yet or stored by an older version
+            pass
+        else:
+            if prev_sig == sig:
+                return lst
+
+        try:
+            lst = filter_directives(filepath)
+        except EnvironmentError:
+            raise PreprocError('could not read the file %s' % filepath)
+        self.parse_cache[filepath] = (sig, lst)
+        return lst
+
+    def start(self, node):
+        """
+        Preprocess a source file and accumulate its includes into
+        :py:attr:`nodes` and :py:attr:`names`. Returns the includes of this
+        file alone, in the order they were found.
+        """
+        Logs.debug('sffpreproc: scanning %s' % node.abspath())
+        self.file_nodes = []
+        self.file_uses = set()
+        self.file_defines = set()
+        self.file_packages = set()
+        self.process(node, 0)
+        return self.file_nodes
+
+    def needs_carried(self, entering):
+        """
+        True if the file just started referenced a macro from entering, the
+        names defined before it, without defining the macro itself or
+        including a header which defines it.
+        """
+        return bool((self.file_uses - self.file_defines) & set(entering))
+
+    def header_defines(self, node, seen=None):
+        """
+        Return the set of macros a header and the headers it includes may
+        define, whatever their `ifdef say. A guarded header included again
+        skips its body, but the macros it would define are those defined by
+        its first inclusion.
+        """
+        try:
+            return self.defines_cache[node]
+        except KeyError:
+            pass
+        if seen is None:
+            seen = set()
+        seen.add(node)
+        names = set()
+        for (token, arg) in self.directives(node):
+            if token == 'define':
+                names.add(arg[0])
+            elif token == 'include':
+                name = extract_include(arg, self.defs)
+                found = name and self.tryfind(name)
+                if found and found not in seen:
+                    names.update(self.header_defines(found, seen))
+        self.defines_cache[node] = names
+        return names
+
+    def process(self, node, depth):
+        if depth > recursion_limit:
+            raise PreprocError('recursion limit exceeded in %s' %
+                node.abspath())
+        state = []
+        lst = self.directives(node)
+        for (token, arg) in lst:
+            if token == 'uses':
+                self.file_uses.update(arg)
+                continue
+            elif token == 'package':
+                self.file_packages.update(arg)
+                continue
+            elif token in ('ifdef', 'ifndef'):
+                if skipped in state or ignored in state:
+                    state.append(skipped)
+                elif (arg in self.defs) == (token == 'ifdef'):
+                    state.append(accepted)
+                else:
+                    state.append(ignored)
+                continue
+            elif token == 'elsif':
+                if state and state[-1] == accepted:
+                    state[-1] = skipped
+                elif state and state[-1] == ignored and arg in self.defs:
+                    state[-1] = accepted
+                continue
+            elif token == 'else':
+                if state and state[-1] == accepted:
+                    state[-1] = skipped
+                elif state and state[-1] == ignored:
+                    state[-1] = accepted
+                continue
+            elif token == 'endif':
+                if state:
+                    state.pop()
+                continue
+
+            if skipped in state or ignored in state:
+                continue
+
+            if token == 'define':
+                self.defs[arg[0]] = arg[1]
+                self.file_defines.add(arg[0])
+            elif token == 'undef':
+                self.defs.pop(arg, None)
+            elif token == 'undefineall':
+                self.defs.clear()
+            elif token == 'include':
+                name = extract_include(arg, self.defs)
+                if not name:
+                    Logs.debug('sffpreproc: cannot resolve include %s in %s'
+                        % (arg, node.abspath()))
+                    continue
+                found = self.tryfind(name)
+                if found:
+                    if found not in self.seen:
+                        self.seen.add(found)
+                        self.nodes.append(found)
+                    if found not in self.file_nodes:
+                        self.file_nodes.append(found)
+                    self.file_defines.update(self.header_defines(found))
+                    self.process(found, depth + 1)
+                elif name not in self.names:
+                    self.names.append(name)
+
+def scan(task):
+    """
+    Get the `include dependencies of all the inputs of a task. Same return
+    value as any waf scanner, a tuple of (nodes, names).
+
+    The includes of each input are also stored on the task in
+    task.sff_file_deps as a list of (input, includes, carried, packages)
+    where carried is True when the input uses macros defined by the inputs
+    before it and packages lists the packages the input declares.
+    """
+    bld = task.generator.bld
+    tmp = verilog_parser(bld.bldnode, list(getattr(task, 'includes', [])))
+    try:
+        tmp.parse_cache = bld.sff_cache.setdefault('scan', {})
+    except AttributeError:
+        pass
+    try:
+        edges = bld.sff_scan_edges
+    except AttributeError:
+        edges = bld.sff_scan_edges = {}
+    tmp.edges = edges.setdefault(tmp.incdirs_key, {})
+
+    task.sff_file_deps = []
+    for node in task.inputs:
+        entering = list(tmp.defs)
+        deps = tmp.start(node)
+        task.sff_file_deps.append((node, deps, tmp.needs_carried(entering),
+            sorted(tmp.file_packages)))
+
+    inputs = set(task.inputs)
+    nodes = [n for n in tmp.nodes if n not in inputs]
+    if Logs.verbose:
+        Logs.debug('sffpreproc: deps for %r: %r; unresolved %r' %
+            (task.inputs, nodes, tmp.names))
+    return (nodes, tmp.names)
@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Matching of the output of the elaboration and simulation tasks, line by
+line as the tool runs, see SFFtask.SFFSimTask.
+
+A line matching a fatal pattern, or the error line taking the count of
+errors to --max_errors, aborts the run. The default patterns cover the
+messages of Incisive, Modelsim and UVM; --fatal_regex and --error_regex
+replace them. vsim -c prefixes every line of its transcript with '# ', the
+patterns allow it.
+"""
+
+import re
+from waflib import Errors
+from waflib import Options
+
+PREFIX = r'^(?:#\s*)?'
+"""The start of a line, with the '# ' of a vsim transcript"""
+
+FATAL_PATTERNS = [
+    PREFIX + r'UVM_FATAL(?!\s*:)',
+    PREFIX + r'\*\* Fatal:',
+    PREFIX + r'\w+: \*F,',
+]
+"""Incisive *F, Modelsim ** Fatal and UVM_FATAL messages. The UVM report
+summary (UVM_FATAL :    0) is not a message"""
+
+ERROR_PATTERNS = [
+    PREFIX + r'UVM_ERROR(?!\s*:)',
+    PREFIX + r'\*\* Error',
+    PREFIX + r'\w+: \*E,',
+]
+"""Incisive *E, Modelsim ** Error and UVM_ERROR messages"""
+
+
+class OutputMatcher(object):
+    """
+    Count the error lines and find the line aborting a run. One matcher
+    per task, fed every line of its output.
+    """
+    def __init__(self, fatal=None, error=None, max_errors=0):
+        self.fatal = re.compile('|'.join(fatal or FATAL_PATTERNS))
+        self.error = re.compile('|'.join(error or ERROR_PATTERNS))
+        self.max_errors = max_errors
+        """Errors aborting the run, 0 for no limit"""
+        self.errors = 0
+        self.reason = None
+        """Why the run must be aborted, None to carry on"""
+
+    def feed(self, line):
+        """
+        Match a line of output. Returns the reason to abort the run the
+        first time one is found, None otherwise.
+        """
+        if self.reason:
+            return None
+        if self.fatal.search(line):
+            self.reason = 'fatal: ' + line.strip()
+        elif self.error.search(line):
+            self.errors += 1
+            if self.max_errors and self.errors >= self.max_errors:
+                self.reason = '%d errors' % self.errors
+        return self.reason
+
+def from_options():
+    """Return a new OutputMatcher set up by the command line options"""
+    opts = Options.options
+    fatal = getattr(opts, 'fatal_regex', None)
+    error = getattr(opts, 'error_regex', None)
+    try:
+        return OutputMatcher(fatal and [fatal], error and [error],
+            getattr(opts, 'max_errors', 0) or 0)
+    except re.error as e:
+        raise Errors.WafError('Invalid --fatal_regex or --error_regex: %s' % e)
@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Stat based signatures of the source files, selected with --stat_hash on the
+build commands. After waflib/extras/md5_tstamp.py but limited to the
+signatures of the source nodes and stored with the SFF data.
+
+The signature of a source file, Node.sig, is kept in bld.sff_cache['stat']
+with the inode, size and modification time (in nanoseconds) of the file
+when it was hashed, keyed by the file path. While the three are unchanged
+the signature is reused without reading the file, which is what makes a
+no-op build of a large tree on NFS fast. Otherwise the file is hashed again,
+so a file touched but not changed still has the same signature and does not
+cause a recompile.
+
+A file modified less than RACY seconds before it was hashed is not
+recorded: it could still change within the resolution of the file system
+timestamps without its stat changing. It is hashed again by the next build.
+"""
+
+import os
+import threading
+import time
+from waflib import Logs
+from waflib import Node
+from waflib import Options
+from waflib import Utils
+
+RACY = 2.0
+"""Age in seconds a file must have to record its stat"""
+
+_lock = threading.Lock()
+"""Guards the counts, updated by the build and --hash_threads threads"""
+
+
+def mtime_ns(st):
+    """Return the modification time of st in nanoseconds"""
+    try:
+        return st.st_mtime_ns
+    except AttributeError:
+        # Python 2
+        return int(st.st_mtime * 1000000000)
+
+def stat_sig(node, stats):
+    """
+    Return the signature of the source node, hashing the file only if its
+    stat differs from the one recorded in stats.
+    """
+    path = node.abspath()
+    try:
+        st = os.stat(path)
+    except EnvironmentError:
+        stats.pop(path, None)
+        raise
+    key = (st.st_ino, st.st_size, mtime_ns(st))
+    entry = stats.get(path)
+    if entry and entry[:3] == key:
+        with _lock:
+            node.ctx.sff_stat_hits += 1
+        return entry[3]
+    sig = Utils.h_file(path)
+    if time.time() - st.st_mtime > RACY:
+        stats[path] = key + (sig,)
+    else:
+        stats.pop(path, None)
+    with _lock:
+        node.ctx.sff_stat_hashed += 1
+    return sig
+
+def get_bld_sig(self):
+    try:
+        return self.cache_sig
+    except AttributeError:
+        pass
+    stats = getattr(self.ctx, 'sff_stat', None)
+    if stats is None or (self.is_bld() and
+            self.ctx.bldnode is not self.ctx.srcnode):
+        return get_bld_sig.orig(self)
+    self.sig = self.cache_sig = stat_sig(self, stats)
+    return self.sig
+
+def report(bld):
+    Logs.info('Stat hashing: %d files hashed, %d unchanged' % (
+        bld.sff_stat_hashed, bld.sff_stat_hits))
+
+def setup(bld):
+    """
+    Use the stat based signatures in the build bld if --stat_hash was
+    given. Must be called before the build runs.
+    """
+    if not getattr(Options.options, 'stat_hash', False):
+        return
+    if getattr(bld, 'sff_stat', None) is not None:
+        return
+    if not hasattr(get_bld_sig, 'orig'):
+        get_bld_sig.orig = Node.Node.get_bld_sig
+        Node.Node.get_bld_sig = get_bld_sig
+    bld.sff_stat = bld.sff_cache.setdefault('stat', {})
+    bld.sff_stat_hits = bld.sff_stat_hashed = 0
+    if Logs.verbose:
+        bld.add_post_fun(report)
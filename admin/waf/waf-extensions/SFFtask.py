@@ -0,0 +1,367 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Base class for the tasks that compile a SFFUnit's sources into a simulator
+library. The simulator tools subclass it and provide compile_cmd().
+
+Incremental compilation (configure --incremental):
+The signature of every source is stored in bld.sff_cache['libs'] keyed by the
+library. A source's signature covers its contents, the contents of every file
+it `includes and whether it saw macros from the sources before it. When the
+task runs only the sources whose signature changed are handed to the
+compiler. The whole library is recompiled instead when:
+1) The library, its flags or its include directories changed.
+2) A source was removed. The library is deleted first as the design units
+   of the source would otherwise remain in it.
+3) A changed source relies on macros defined by the sources before it.
+   Macros defined by the headers a source includes itself do not count,
+   even when a header guard skips them.
+4) A changed source declares a package, as the sources importing it must
+   be compiled again.
+
+The includes of each source come from the native scanner, which is run
+again for a task about to execute if waf did not need to rescan it.
+
+When SFF_LIB_CACHE is set a library is restored from the library cache
+instead of being compiled, and stored in it once compiled, see SFFlibcache.
+
+With --compile_workers the compile commands run on the prefork workers, see
+SFFworkers.
+
+Also the tasks running the elaboration and simulation commands of the tools.
+A simulation runs every time, an elaboration only when its signature changes.
+Under waf watch a simulation runs again only after its elaboration.
+Their output is matched as it comes to stop a failing run early, see
+SFFsimlog.
+"""
+
+from waflib import Logs
+from waflib import Task
+from waflib import Utils
+import os
+import shutil
+import signal
+import sys
+import time
+import SFFlibcache
+import SFFpreproc
+import SFFsimlog
+import SFFworkers
+
+
+class SFFCompileTask(Task.Task):
+    """
+    Compile the sources of one unit into the library node passed as output.
+    """
+    def __init__(self, *k, **kw):
+        Task.Task.__init__(self, *k, **kw)
+
+        self.set_inputs(sorted(kw['source'], key=lambda n: n.abspath()))
+        self.set_outputs(kw['output'])
+        self.includes = kw['includes']
+        """Include directory nodes in search order"""
+        self.incargs = kw.get('incargs', '')
+        """The includes formatted as compiler arguments"""
+        from types import MethodType
+        self.scan = MethodType(kw['scan'],self)
+
+    def __str__(self):
+        return '%s: %s\n' % (self.__class__.__name__,self.outputs[0])
+
+    def exec_command(self, cmd, **kw):
+        """Run cmd on the compile workers if the build started them."""
+        workers = getattr(self.generator.bld, 'sff_workers', None)
+        if workers is None:
+            return super(SFFCompileTask, self).exec_command(cmd, **kw)
+        kw.setdefault('cwd', self.generator.bld.variant_dir)
+        return workers.exec_command(self.outputs[0].name, cmd, **kw)
+
+    def compile_cmd(self, srcs):
+        """Return the command compiling the list of source nodes srcs."""
+        raise NotImplementedError
+
+    def runnable_status(self):
+        """
+        Work out the source signatures in the main thread once the task is
+        known to run, as nodes must not be created by the worker threads.
+        """
+        ret = super(SFFCompileTask, self).runnable_status()
+        if ret == Task.RUN_ME and self.env['SFF_INCREMENTAL']:
+            if not hasattr(self, 'sff_file_deps'):
+                SFFpreproc.scan(self)
+            self.new_sigs = self.src_sigs()
+            self.new_flags = self.flags_sig()
+        return ret
+
+    def run(self):
+        if self.can_retrieve_cache():
+            Logs.info('%s: restored from the library cache' %
+                self.outputs[0].name)
+            if self.env['SFF_INCREMENTAL']:
+                self.store_src_sigs()
+            return 0
+        srcs = self.inputs
+        if self.env['SFF_INCREMENTAL']:
+            srcs = self.incremental_srcs()
+            if not srcs:
+                return 0
+            if len(srcs) != len(self.inputs):
+                Logs.info('%s: recompiling %d of %d sources' % (
+                    self.outputs[0].name, len(srcs), len(self.inputs)))
+        ret = self.exec_command(self.compile_cmd(srcs))
+        if not ret and self.env['SFF_INCREMENTAL']:
+            self.store_src_sigs()
+        return ret
+
+    def post_run(self):
+        ret = super(SFFCompileTask, self).post_run()
+        self.put_files_cache()
+        return ret
+
+    def can_retrieve_cache(self):
+        """Restore the library from the library cache on a hit."""
+        self.cached = SFFlibcache.retrieve(self)
+        return self.cached
+
+    def put_files_cache(self):
+        """Store the library just compiled in the library cache."""
+        if not getattr(self, 'cached', False):
+            SFFlibcache.store(self)
+
+    def flags_sig(self):
+        """Hash the settings which affect every source in the library."""
+        m = Utils.md5()
+        m.update(self.__class__.__name__.encode())
+        m.update(self.generator.bld.hash_env_vars(self.env,
+            getattr(self, 'dep_vars', [])))
+        for inc in self.includes:
+            m.update(inc.abspath().encode())
+        return m.digest()
+
+    def src_sigs(self):
+        """
+        Return a dictionary of source path -> (signature, reason) from the
+        includes of each source recorded by the scanner. reason says why a
+        change to the source recompiles the whole library, or is None.
+        """
+        sigs = {}
+        for (node, deps, carried, packages) in self.sff_file_deps:
+            m = Utils.md5()
+            m.update(node.get_bld_sig())
+            for d in deps:
+                m.update(d.get_bld_sig())
+            m.update(str(carried).encode())
+            reason = None
+            if carried:
+                reason = 'uses macros from the sources before it'
+            elif packages:
+                reason = 'declares the package %s' % ', '.join(packages)
+            sigs[node.abspath()] = (m.digest(), reason)
+        return sigs
+
+    def incremental_srcs(self):
+        """
+        Return the list of sources to compile, either the changed ones or
+        all of them if the library must be rebuilt.
+        """
+        lib = self.outputs[0].abspath()
+        try:
+            (flags, old_sigs) = self.generator.bld.sff_cache['libs'][lib]
+        except KeyError:
+            Logs.debug('sfftask: %s was never compiled' % lib)
+            return self.inputs
+        if flags != self.new_flags or not os.path.isdir(lib):
+            Logs.debug('sfftask: %s flags or includes changed' % lib)
+            return self.inputs
+        if set(old_sigs) - set(self.new_sigs):
+            Logs.debug('sfftask: %s had sources removed' % lib)
+            self.clean_library()
+            return self.inputs
+
+        srcs = []
+        for node in self.inputs:
+            (sig, reason) = self.new_sigs[node.abspath()]
+            if old_sigs.get(node.abspath()) != sig:
+                if reason:
+                    Logs.debug('sfftask: %s %s' % (node.abspath(), reason))
+                    return self.inputs
+                srcs.append(node)
+        return srcs
+
+    def clean_library(self):
+        """Delete the library and create it again, empty."""
+        lib = self.outputs[0].abspath()
+        shutil.rmtree(lib)
+        os.makedirs(lib)
+
+    def store_src_sigs(self):
+        """Record the source signatures after a successful compile."""
+        libs = self.generator.bld.sff_cache.setdefault('libs', {})
+        libs[self.outputs[0].abspath()] = (self.new_flags,
+            dict((k, v[0]) for (k, v) in self.new_sigs.items()))
+
+
+def order_unit_tasks(top, tasks, tb_task):
+    """
+    Make each unit's compile task run after the tasks of the units it uses,
+    and the testbench task after the top level and the units in its tb_use.
+    tasks maps unit names to compile tasks. Independent units have no edges
+    between them so they compile in parallel.
+    """
+    for u in top.synu_deps + top.simu_deps:
+        for dep in u.use('use') or []:
+            tasks[u.name].set_run_after(tasks[dep])
+    tb_task.set_run_after(tasks[top.name])
+    for dep in top.use('tb_use') or []:
+        tb_task.set_run_after(tasks[dep])
+
+
+class SFFSimTask(Task.Task):
+    """
+    Run the shell command cmd from the directory node cwd every time the
+    build runs, e.g. an elaboration or a simulation.
+
+    The output is read line by line as the tool runs. Each line is written
+    to the file log in cwd and given to an SFFsimlog.OutputMatcher, which
+    may kill the tool early. It is also echoed to the terminal unless the
+    task is a test.
+
+    For a test of a regression, test is its name. The exit status and the
+    run time are kept in status and duration for the summary and a failure
+    does not stop the build, so the other tests still run.
+    """
+    def __init__(self, *k, **kw):
+        Task.Task.__init__(self, *k, **kw)
+
+        self.cmd = kw['cmd']
+        self.cwd = kw['cwd']
+        self.test = kw.get('test')
+        self.log = kw.get('log', 'sim.log')
+        self.matcher = SFFsimlog.from_options()
+        self.status = None
+        self.duration = None
+
+    def __str__(self):
+        return '%s: %s\n' % (self.__class__.__name__, self.test or self.cmd)
+
+    def uid(self):
+        """The task has no inputs or outputs, identify it by its command"""
+        try:
+            return self.uid_
+        except AttributeError:
+            m = Utils.md5()
+            m.update(self.__class__.__name__.encode())
+            m.update(self.cmd.encode())
+            m.update(self.cwd.abspath().encode())
+            self.uid_ = m.digest()
+            return self.uid_
+
+    def runnable_status(self):
+        ret = super(SFFSimTask, self).runnable_status()
+        if ret == Task.SKIP_ME:
+            # Between the runs of waf watch, see SFFwatch
+            if getattr(self.generator.bld, 'sff_watching', False) and not [
+                    t for t in self.run_after if t.hasrun == Task.SUCCESS]:
+                return ret
+            return Task.RUN_ME
+        return ret
+
+    def run(self):
+        self.cwd.mkdir()
+        start = time.time()
+        self.status = self.exec_streaming()
+        self.duration = time.time() - start
+        if self.test:
+            return 0
+        if self.matcher.reason:
+            self.err_msg = ' -> %r stopped on %s, see %s' % (self.cmd,
+                self.matcher.reason, self.log_path())
+        return self.status
+
+    def log_path(self):
+        return os.path.join(self.cwd.abspath(), self.log)
+
+    def exec_streaming(self):
+        """
+        Run cmd, writing its output to the log as it comes. Returns the exit
+        status, 1 if the matcher aborted the run.
+        """
+        bld = self.generator.bld
+        Logs.debug('runner: %r' % self.cmd)
+        kw = {'shell': True, 'cwd': self.cwd.abspath(),
+            'stdout': Utils.subprocess.PIPE,
+            'stderr': Utils.subprocess.STDOUT}
+        if hasattr(os, 'setsid'):
+            # Own process group so the tool is killed with the shell
+            kw['preexec_fn'] = os.setsid
+        try:
+            proc = Utils.subprocess.Popen(self.cmd, **kw)
+        except OSError as e:
+            Logs.error('%s: %s' % (self.cmd, e))
+            return -1
+
+        with open(self.log_path(), 'w') as log:
+            for line in iter(proc.stdout.readline, b''):
+                if not isinstance(line, str):
+                    line = line.decode(sys.stdout.encoding or 'iso8859-1',
+                        'replace')
+                log.write(line)
+                log.flush()
+                if not self.test:
+                    sys.stdout.write(line)
+                if self.matcher.feed(line):
+                    Logs.error('%s: %s, stopping the run' % (
+                        self.test or self.cwd.name, self.matcher.reason))
+                    self.kill(proc)
+            proc.stdout.close()
+        ret = proc.wait()
+        if self.matcher.reason:
+            return ret or 1
+        return ret
+
+    def kill(self, proc):
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(proc.pid, signal.SIGTERM)
+            else:
+                proc.terminate()
+        except OSError:
+            pass
+
+class SFFElabTask(SFFSimTask):
+    """
+    Elaborate a design with the shell command cmd from the directory node
+    cwd. Unlike SFFSimTask it only runs when its signature changes. The
+    inputs are the compiled library nodes libs, whose signatures change with
+    every compile, and the signature also covers the command, the contents
+    of the generated files nodes (cds.lib...) and the env dep_vars. The
+    stamp node is written once the elaboration succeeds.
+    """
+    def __init__(self, *k, **kw):
+        kw.setdefault('log', kw['stamp'].name + '.log')
+        SFFSimTask.__init__(self, *k, **kw)
+
+        self.set_inputs(kw['libs'])
+        self.set_outputs(kw['stamp'])
+        self.files = kw.get('files', [])
+        self.dep_vars = kw.get('dep_vars', [])
+
+    def uid(self):
+        return Task.Task.uid(self)
+
+    def runnable_status(self):
+        return Task.Task.runnable_status(self)
+
+    def sig_vars(self):
+        Task.Task.sig_vars(self)
+        self.m.update(self.cmd.encode())
+        for node in self.files:
+            self.m.update(Utils.h_file(node.abspath()))
+        return self.m.digest()
+
+    def run(self):
+        ret = SFFSimTask.run(self)
+        if not ret:
+            self.outputs[0].write(self.cmd + '\n')
+        return ret
@@ -0,0 +1,233 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Build tracing, selected with --trace=FILE on the build commands. After the
+idea of waflib/extras/parallel_debug.py but written as Chrome trace events
+(load FILE in chrome://tracing or https://ui.perfetto.dev).
+
+For every task it records:
+1) status: the runnable_status() calls made by the scheduler in the main
+   thread, signature included, except the ones answering ASK_LATER.
+2) scan: the implicit dependencies, including the scanner, nested in 1).
+3) queue: the wait between being found runnable and a worker starting it.
+4) run: the execution by the worker thread, post_run() included.
+
+Once the build is over, failed or not, the trace is written and a summary
+printed: the time in each phase, the critical path through the run times
+of the tasks and their run_after constraints, and how busy each worker
+thread was.
+"""
+
+import json
+import threading
+import time
+from waflib import Logs
+from waflib import Options
+from waflib import Runner
+from waflib import Task
+
+_tracer = None
+"""The Tracer of the build being traced, None when not tracing"""
+
+
+class Tracer(object):
+    """The events and the task timings of one build"""
+    def __init__(self, path, jobs):
+        self.path = path
+        self.jobs = jobs
+        self.t0 = time.time()
+        self.events = []
+        self.tids = {}
+        self.lock = threading.Lock()
+        """Guards tids, events and phases, updated by every build thread"""
+        self.runs = {}
+        """Maps a task to its run time in seconds"""
+        self.phases = {'status': 0.0, 'scan': 0.0, 'queue': 0.0, 'run': 0.0}
+
+    def tid(self):
+        """Return a small number identifying the current thread"""
+        thread = threading.current_thread()
+        with self.lock:
+            try:
+                return self.tids[thread]
+            except KeyError:
+                tid = self.tids[thread] = len(self.tids)
+                return tid
+
+    def us(self, t):
+        return int((t - self.t0) * 1e6)
+
+    def add_time(self, phase, seconds):
+        """Add seconds to the total of phase"""
+        with self.lock:
+            self.phases[phase] += seconds
+
+    def add(self, phase, tsk, start, end, tid=None):
+        """Record a complete event of phase for tsk"""
+        if tid is None:
+            tid = self.tid()
+        event = {'name': name(tsk), 'cat': phase, 'ph': 'X',
+            'ts': self.us(start), 'dur': self.us(end) - self.us(start),
+            'pid': 1, 'tid': tid}
+        with self.lock:
+            self.phases[phase] += end - start
+            self.events.append(event)
+
+    def add_queue(self, tsk, start, end):
+        """Record the wait of tsk, waits overlap so they are async events"""
+        events = [{'name': name(tsk), 'cat': 'queue', 'ph': ph,
+            'ts': self.us(t), 'id': id(tsk), 'pid': 1, 'tid': 'queue'}
+            for (ph, t) in (('b', start), ('e', end))]
+        with self.lock:
+            self.phases['queue'] += end - start
+            self.events.extend(events)
+
+    def critical_path(self):
+        """
+        Return (seconds, tasks) of the longest chain of run times following
+        the run_after constraints.
+        """
+        finish = {}
+        prev = {}
+        def visit(tsk):
+            # Iterative depth first walk, the chains can be long
+            stack = [tsk]
+            while stack:
+                t = stack[-1]
+                todo = [p for p in t.run_after
+                    if p in self.runs and p not in finish]
+                if todo:
+                    stack.extend(todo)
+                    continue
+                stack.pop()
+                if t in finish:
+                    continue
+                best = None
+                for p in t.run_after:
+                    if p in finish and (best is None or
+                            finish[p] > finish[best]):
+                        best = p
+                prev[t] = best
+                finish[t] = self.runs[t] + (finish[best] if best else 0.0)
+        for tsk in self.runs:
+            visit(tsk)
+        if not finish:
+            return (0.0, [])
+        last = max(finish, key=lambda t: finish[t])
+        chain = []
+        t = last
+        while t is not None:
+            chain.append(t)
+            t = prev[t]
+        return (finish[last], list(reversed(chain)))
+
+    def summary(self, wall):
+        """Return the lines of the summary for a build of wall seconds"""
+        lines = ['Trace written to %s' % self.path]
+        lines.append('Time in status %.3fs, scan %.3fs, queue %.3fs, run '
+            '%.3fs over %.3fs' % (self.phases['status'], self.phases['scan'],
+            self.phases['queue'], self.phases['run'], wall))
+        (length, chain) = self.critical_path()
+        lines.append('Critical path %.3fs over %d tasks: %s' % (length,
+            len(chain), ' -> '.join(name(t) for t in chain)))
+        busy = {}
+        for e in self.events:
+            if e['cat'] == 'run':
+                busy[e['tid']] = busy.get(e['tid'], 0) + e['dur'] / 1e6
+        for (thread, tid) in sorted(self.tids.items(), key=lambda x: x[1]):
+            if tid in busy:
+                lines.append('%-20s busy %.3fs, idle %.1f%%' % (thread.name,
+                    busy[tid], 100.0 * max(wall - busy[tid], 0) / wall
+                    if wall else 0.0))
+        if len(busy) < self.jobs:
+            lines.append('%d of %d workers never ran a task' % (
+                self.jobs - len(busy), self.jobs))
+        return lines
+
+    def write(self):
+        """Write the trace and log the summary"""
+        wall = time.time() - self.t0
+        events = list(self.events)
+        for (thread, tid) in self.tids.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1,
+                'tid': tid, 'args': {'name': thread.name}})
+        lines = self.summary(wall)
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'summary': lines}}, f)
+        for line in lines:
+            Logs.info(line)
+
+
+def name(tsk):
+    return str(tsk).strip()
+
+def _task_status(self, tsk):
+    if _tracer is None:
+        return _task_status.orig(self, tsk)
+    start = time.time()
+    ret = _task_status.orig(self, tsk)
+    end = time.time()
+    if ret != Task.ASK_LATER:
+        _tracer.add('status', tsk, start, end)
+    else:
+        _tracer.add_time('status', end - start)
+    if ret == Task.RUN_ME:
+        tsk.sff_ready = end
+    return ret
+
+def _sig_implicit_deps(self):
+    if _tracer is None:
+        return _sig_implicit_deps.orig(self)
+    start = time.time()
+    try:
+        return _sig_implicit_deps.orig(self)
+    finally:
+        _tracer.add('scan', self, start, time.time())
+
+def _process(self):
+    if _tracer is None:
+        return _process.orig(self)
+    start = time.time()
+    ready = getattr(self, 'sff_ready', None)
+    if ready is not None:
+        _tracer.add_queue(self, ready, start)
+    try:
+        return _process.orig(self)
+    finally:
+        end = time.time()
+        _tracer.runs[self] = end - start
+        _tracer.add('run', self, start, end)
+
+def _install():
+    """Wrap the waf methods, once per process"""
+    if hasattr(_process, 'orig'):
+        return
+    _task_status.orig = Runner.Parallel.task_status
+    Runner.Parallel.task_status = _task_status
+    _sig_implicit_deps.orig = Task.Task.sig_implicit_deps
+    Task.Task.sig_implicit_deps = _sig_implicit_deps
+    _process.orig = Task.TaskBase.process
+    Task.TaskBase.process = _process
+
+def setup(bld):
+    """
+    Trace the build bld if --trace was given. Must be called before the
+    build runs. Each run of the build writes a new trace, see SFFwatch.
+    """
+    path = getattr(Options.options, 'trace', None)
+    if not path or getattr(bld, 'sff_trace', None):
+        return
+    _install()
+    bld.sff_trace = Tracer(path, bld.jobs)
+    compile_ = bld.compile
+    def compile():
+        global _tracer
+        bld.sff_trace = _tracer = Tracer(path, bld.jobs)
+        try:
+            return compile_()
+        finally:
+            _tracer = None
+            bld.sff_trace.write()
+    bld.compile = compile
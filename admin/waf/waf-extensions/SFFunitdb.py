@@ -0,0 +1,176 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+On-disk database of the SFFUnits written by configure and read by the build
+commands, replacing the pickled SFFUnitsCont kept in the ConfigSet.
+
+The file is binary and laid out as:
+1) MAGIC followed by the format version and the header length, as
+   HEADER_FMT.
+2) The header, a pickled dictionary holding the index of the units by name
+   and the data of the container (top levels, views...).
+3) The packed units, each pickled on its own.
+
+The index maps a unit name to the (offset, length) of its record so a build
+unpickles only the units it needs. The deps of a unit are stored as names.
+"""
+
+import os
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import struct
+from waflib import Errors
+
+MAGIC = b'SFFUNITS'
+"""Identifies a unit database"""
+
+VERSION = 1
+"""Bumped whenever the layout or the pickled classes change"""
+
+HEADER_FMT = '<8sII'
+"""Magic, version and length of the pickled header"""
+
+PROTOCOL = 2
+"""Pickle protocol, the highest one Python 2 can read"""
+
+FILENAME = 'SFFUnits.db'
+"""Name of the database in the configuration cache directory"""
+
+
+def write(path, units, header):
+    """
+    Write the packed units, a dictionary of name -> unit, and the dictionary
+    header to path. The file is replaced atomically.
+    """
+    records = []
+    index = {}
+    offset = 0
+    for name in sorted(units):
+        data = pickle.dumps(units[name], PROTOCOL)
+        index[name] = (offset, len(data))
+        offset += len(data)
+        records.append(data)
+
+    header = dict(header)
+    header['index'] = index
+    hdr = pickle.dumps(header, PROTOCOL)
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(struct.pack(HEADER_FMT, MAGIC, VERSION, len(hdr)))
+        f.write(hdr)
+        for data in records:
+            f.write(data)
+    os.rename(tmp, path)
+
+
+class UnitDB(object):
+    """
+    Read access to a unit database. Only the header is unpickled when the
+    database is opened, the units are unpickled by :py:meth:`load`.
+    """
+    def __init__(self, path):
+        try:
+            if not path:
+                raise IOError
+            with open(path, 'rb') as f:
+                data = f.read()
+        except EnvironmentError:
+            raise Errors.WafError('Unit database {0} not found. Please run '
+                '"waf configure".'.format(path or FILENAME))
+
+        size = struct.calcsize(HEADER_FMT)
+        try:
+            (magic, version, hdr_len) = struct.unpack(HEADER_FMT, data[:size])
+        except struct.error:
+            magic = version = None
+        if magic != MAGIC or version != VERSION:
+            raise Errors.WafError('Unit database {0} was written by another '
+                'version of SFF. Please re-run "waf configure".'.format(path))
+
+        self.path = path
+        self.header = pickle.loads(data[size:size + hdr_len])
+        self.index = self.header['index']
+        self._data = data
+        self._start = size + hdr_len
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def load(self, name):
+        """Unpickle and return the packed unit name"""
+        (offset, length) = self.index[name]
+        start = self._start + offset
+        return pickle.loads(self._data[start:start + length])
+
+
+class UnitIndex(dict):
+    """
+    Dictionary of the units reachable from the top level, unpickled from a
+    UnitDB on first access. The keys are known up front so iterating the
+    names loads nothing. Loading a unit loads the units in its deps too,
+    calling unpack(unit) for each one and then resolve(unit) once all of
+    them are loaded.
+    """
+    def __init__(self, db, names, unpack, resolve):
+        dict.__init__(self)
+        self.db = db
+        self.names = list(names)
+        self._known = set(self.names)
+        self._unpack = unpack
+        self._resolve = resolve
+
+    def __missing__(self, name):
+        if name not in self._known:
+            raise KeyError(name)
+        unit = self.db.load(name)
+        # The deps are stored leaf first so loading them in order, without
+        #  recursion, unpacks every dep before the units using it.
+        new = []
+        for dep in unit.synu_deps + unit.simu_deps:
+            if dep != name and not dict.__contains__(self, dep):
+                dep_unit = self.db.load(dep)
+                dict.__setitem__(self, dep, dep_unit)
+                new.append(dep_unit)
+        dict.__setitem__(self, name, unit)
+        new.append(unit)
+        for u in new:
+            self._unpack(u)
+        for u in new:
+            self._resolve(u)
+        return unit
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __contains__(self, name):
+        return name in self._known
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def keys(self):
+        return list(self.names)
+
+    def values(self):
+        return [self[name] for name in self.names]
+
+    def items(self):
+        return [(name, self[name]) for name in self.names]
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
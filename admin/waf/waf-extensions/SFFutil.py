@@ -1,5 +1,7 @@
+import os
 from waflib import Errors
 from waflib import Node
+from waflib import Utils
 import SFFerrors
 
 def strtolist(string_or_list):
@@ -26,3 +28,19 @@ def list2nodes(self, subdir, list_, silent_fail):
                 "'{0}': Failed to find '{1}' on disk.".format(
                     self.name, subdir.srcpath() + '/' + node))
     return nodes
+
+def write_if_changed(node, txt):
+    """
+    Write txt to node unless it holds txt already. The file is replaced
+    atomically. Returns True if it was written.
+    """
+    path = node.abspath()
+    try:
+        if Utils.readf(path) == txt:
+            return False
+    except EnvironmentError:
+        pass
+    tmp = path + '.tmp'
+    Utils.writef(tmp, txt)
+    os.rename(tmp, path)
+    return True
@@ -0,0 +1,219 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Classes and helper functions used to provide
+"sim_source"
+"verify_source"
+via Verilator, selected with SFF_SIM_ENV=verilator
+
+Verilator has no compiled libraries. The library of a unit, <unit>_vlt, holds
+its sources preprocessed by verilator -E into <unit>.sv, with their `line
+directives so the messages point to the original files. This checks the
+sources of each unit, in parallel, and lets the library cache and the
+incremental build work as with the other simulators.
+
+The elaboration verilates the preprocessed units and the testbench into a
+C++ model and builds it with verilator --binary, running the C++ compiles
+in parallel (--verilator_jobs). The model is multi-threaded with
+--verilator_threads. The simulation runs the binary. Verilator needs no
+license so regressions run as many tests in parallel as -j allows.
+"""
+
+from waflib import Logs
+from waflib import Options
+from SFFbuildmgr import SFF_verilog_scan
+from SFFbuildmgr import SFFUnitsCont, SFFUnit, SFFView, load_SFFUnits
+from SFFtask import SFFCompileTask, SFFSimTask, SFFElabTask
+from SFFtask import order_unit_tasks
+import SFFlibcache
+import SFFhash
+import SFFstathash
+import SFFtrace
+import SFFworkers
+
+def options(ctx):
+    ctx.add_option('--verilator_jobs', action='store', type='int',
+                   default=0,
+                   help=('Parallel C++ compiles building a Verilator model, '
+                         '0 for one per CPU [default: %default]'))
+
+    ctx.add_option('--verilator_threads', action='store', type='int',
+                   default=1,
+                   help=('Threads of the Verilator simulations '
+                         '[default: %default]'))
+
+def configure(ctx):
+    """
+    Verilator: Find all the necessary parts of Verilator.
+    """
+    ctx.find_program('verilator')
+    ctx.env['VERILATOR_VERSION'] = SFFlibcache.tool_version(ctx, 'VERILATOR')
+
+def _simulate(ctx, gui):
+    """
+    Load the SFFUnits into the system.
+    Create the necessary tasks to preprocess the units
+    Kick verilator --binary targetting the testbench if the units changed
+    Run the model of the testbench
+    """
+    if gui:
+        Logs.warn('Verilator has no gui, running the simulation in batch')
+    ctx.env['SFFUnits'] = load_SFFUnits(ctx)
+    top = ctx.env['SFFUnits'].getunit(ctx.env.top_level)
+
+    tb_tasks = build_libraries(ctx, [top])
+    elab = elaborate(ctx, top, tb_tasks[top.name], ctx.bldnode)
+    simulate(ctx, top, elab, ctx.bldnode, '')
+
+def build_libraries(ctx, tops):
+    """
+    Creates the directory path and nodes in the build directory.
+    Creates a preprocessing task for each unit used by the top level units
+    tops, once even if several of them use it, and one for the testbench
+    of each top. Each unit gets its own library <unit>_vlt.
+    Returns a dictionary of top level name -> testbench compile task.
+    """
+    SFFworkers.setup(ctx)
+    SFFtrace.setup(ctx)
+    SFFstathash.setup(ctx)
+    SFFhash.setup(ctx)
+    tasks = {}
+    tb_tasks = {}
+    for top in tops:
+        for u in top.synu_deps + top.simu_deps:
+            if u.name in tasks:
+                continue
+            u.b['vlt'] = u.script.parent.get_bld().make_node(u.name+'_vlt')
+            u.b['vlt'].parent.mkdir()
+
+            tsk = VerilatorTask(
+                name=u.name,
+                target=u.b['vlt'],
+                source=u.use('src'),
+                output=u.b['vlt'],
+                includes=u.incpath('includes')[0],
+                incargs=u.incdir_args('includes', '+incdir+'),
+                scan=SFF_verilog_scan,
+                env=ctx.env)
+            ctx.add_to_group(tsk)
+            tasks[u.name] = tsk
+
+        """
+        Create the testbench task last as it is always at the top dep
+        """
+        top.b['tbvlt'] = top.script.parent.get_bld().make_node(
+            top.use('tb')[0]+'_vlt')
+        top.b['tbvlt'].parent.mkdir()
+
+        tsk = VerilatorTask(
+            name=top.use('tb'),
+            target=top.b['tbvlt'],
+            source=top.use('tb_src'),
+            output=top.b['tbvlt'],
+            includes=top.incpath('tb_includes')[0],
+            incargs=top.incdir_args('tb_includes', '+incdir+'),
+            scan=SFF_verilog_scan,
+            env=ctx.env)
+        ctx.add_to_group(tsk)
+        order_unit_tasks(top, tasks, tsk)
+        tb_tasks[top.name] = tsk
+
+    return tb_tasks
+
+def _libs(top):
+    """
+    Return the libraries of the units of top, leaf first, and of its
+    testbench
+    """
+    libs = []
+    for u in top.synu_deps + top.simu_deps:
+        if u.b['vlt'] not in libs:
+            libs.append(u.b['vlt'])
+    return libs + [top.b['tbvlt']]
+
+def _model(run_dir, tb):
+    """Return the directory node verilator builds the model of tb in"""
+    return run_dir.make_node(tb + '_obj')
+
+def elaborate(ctx, top, tb_task, run_dir):
+    """
+    Run verilator --binary on the preprocessed units and testbench of top
+    once they are written, building the model in run_dir/<tb>_obj. It is
+    kept until a unit or the options change. verilator runs from the build
+    directory like the preprocessing, the stamp is written to run_dir.
+    Returns the task.
+    """
+    run_dir.mkdir()
+    tb = top.use('tb')[0]
+    libs = _libs(top)
+    opts = Options.options
+    tsk = SFFElabTask(
+        cmd=('%s --binary -j %d --threads %d -Wno-fatal --timescale '
+            '1ns/10ps --top-module %s -Mdir %s %s') % (
+            ctx.env['VERILATOR'][0], getattr(opts, 'verilator_jobs', 0),
+            getattr(opts, 'verilator_threads', 1), tb,
+            _model(run_dir, tb).bldpath(),
+            ' '.join(VerilatorTask.preprocessed(l).bldpath() for l in libs)),
+        cwd=ctx.bldnode,
+        libs=libs,
+        stamp=run_dir.make_node(tb + '.elab'),
+        files=[],
+        dep_vars=['VERILATOR_VERSION'],
+        env=ctx.env)
+    ctx.add_to_group(tsk)
+    tsk.set_run_after(tb_task)
+    return tsk
+
+def simulate(ctx, top, elab, run_dir, args, test=None, seed=None,
+        plusargs=()):
+    """
+    Run the model of the testbench of top built by the elaboration task
+    elab, from directory run_dir with the options args. For a regression
+    test is the name of the test, seed and plusargs are given to the
+    model. Returns the task.
+    """
+    tb = top.use('tb')[0]
+    opts = [args]
+    if seed is not None:
+        opts.append('+verilator+seed+%s' % seed)
+    opts.extend(plusargs)
+    model = _model(elab.outputs[0].parent, tb).make_node('V' + tb)
+    tsk = SFFSimTask(
+        cmd='%s %s' % (model.abspath(), ' '.join(o for o in opts if o)),
+        cwd=run_dir,
+        test=test,
+        env=ctx.env)
+    ctx.add_to_group(tsk)
+    tsk.set_run_after(elab)
+    return tsk
+
+class VerilatorTask(SFFCompileTask):
+    def __init__(self, *k, **kw):
+        SFFCompileTask.__init__(self, *k, **kw)
+
+        self.dep_vars = ['VERILATOR_VERSION']
+
+    @staticmethod
+    def preprocessed(lib):
+        """Return the node of the preprocessed sources in library lib"""
+        return lib.make_node(lib.name[:-len('_vlt')] + '.sv')
+
+    def incremental_srcs(self):
+        """
+        The sources are preprocessed into one file: any change preprocesses
+        all of them again.
+        """
+        srcs = SFFCompileTask.incremental_srcs(self)
+        if srcs:
+            return self.inputs
+        return srcs
+
+    def compile_cmd(self, srcs):
+        src = ''
+        for s in srcs:
+            src += s.bldpath() + ' '
+        lib = self.outputs[0]
+        return 'mkdir -p %s && %s -E %s %s > %s' % (lib.bldpath(),
+            self.env['VERILATOR'][0], self.incargs, src,
+            self.preprocessed(lib).bldpath())
@@ -0,0 +1,321 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+The watch command: waf watch [verify_source|sim_source|regress]
+
+Runs the build command given after it (verify_source by default), then
+waits for a file of the design to change and runs it again, until
+interrupted. The build context is kept between the runs, so the build
+database, the node tree, the task signatures and the SFFUnitsCont loaded
+from the unit database stay in memory and the wscripts are not read again.
+Each run creates its tasks afresh, only the ones whose signature changed
+execute. A simulation only runs again when its elaboration ran.
+
+The source and testbench directories of the units loaded, with all their
+subdirectories as they are searched recursively, their include directories
+and the directories of every file the tasks depend on are watched, with
+inotify on Linux, through ctypes, and by polling them every POLL_INTERVAL
+seconds otherwise or with --watch_poll (inotify does not see the changes
+made on other hosts of an NFS mount). Directories created while watching
+are watched as well. Changes to hidden files and editor backups are
+ignored. A file created or removed reloads the units from the unit
+database as their source lists may change. Changes to the wscripts are not
+picked up, re-run waf configure.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import re
+import select
+import struct
+import time
+from waflib import Build
+from waflib import Context
+from waflib import Errors
+from waflib import Logs
+from waflib import Options
+from waflib import Task
+from waflib import Utils
+import SFFerrors
+
+POLL_INTERVAL = 1.0
+"""Seconds between two scans of the watched directories when polling"""
+
+SETTLE = 0.2
+"""Seconds without a change before a run starts, to batch the changes"""
+
+IGNORE = re.compile(r'^\.|^#|~$|^4913$')
+"""Hidden files, emacs and vi backups and the vim write test file"""
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+
+IN_CHANGED = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE
+IN_STRUCTURE = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT = struct.Struct('iIII')
+"""struct inotify_event without its name"""
+
+
+def walk(path):
+    """Return path and the directories under it, hidden ones excepted"""
+    dirs = [path]
+    for (root, names, files) in os.walk(path):
+        names[:] = [n for n in names if not IGNORE.search(n)]
+        dirs.extend(os.path.join(root, n) for n in names)
+    return dirs
+
+
+class Changes(object):
+    """The files changed since the last run"""
+    def __init__(self):
+        self.paths = set()
+        self.structure = False
+        """True if files were created, removed or renamed"""
+
+    def __bool__(self):
+        return bool(self.paths) or self.structure
+    __nonzero__ = __bool__
+
+
+class PollWatcher(object):
+    """Watch directories by comparing the stat of their files"""
+    def __init__(self):
+        self.snap = {}
+        """Maps each directory to {file path: (inode, size, mtime)}"""
+
+    def scan(self, path):
+        files = {}
+        try:
+            names = os.listdir(path)
+        except EnvironmentError:
+            return files
+        for name in names:
+            if IGNORE.search(name):
+                continue
+            p = os.path.join(path, name)
+            try:
+                st = os.stat(p)
+            except EnvironmentError:
+                continue
+            files[p] = (st.st_ino, st.st_size, st.st_mtime)
+        return files
+
+    def watch(self, dirs):
+        """Watch dirs as well as the directories already watched"""
+        for path in dirs:
+            if path not in self.snap:
+                self.snap[path] = self.scan(path)
+
+    def changes(self):
+        changes = Changes()
+        created = []
+        for (path, old) in list(self.snap.items()):
+            new = self.scan(path)
+            if set(new) != set(old):
+                changes.structure = True
+                created.extend(p for p in new if p not in old and
+                    os.path.isdir(p))
+            changes.paths.update(p for p in new if new[p] != old.get(p))
+            changes.paths.update(p for p in old if p not in new)
+            self.snap[path] = new
+        for path in created:
+            self.watch(walk(path))
+        return changes
+
+    def wait(self):
+        """Return the Changes once files changed and settled"""
+        while True:
+            time.sleep(POLL_INTERVAL)
+            changes = self.changes()
+            if changes:
+                return changes
+
+
+class InotifyWatcher(object):
+    """Watch directories with the inotify calls of the C library"""
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+            ctypes.c_uint32]
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self.wds = {}
+        """Maps each watch descriptor to its directory"""
+        self.dirs = set()
+
+    def watch(self, dirs):
+        """Watch dirs as well as the directories already watched"""
+        mask = IN_CHANGED | IN_STRUCTURE | IN_ONLYDIR
+        for path in dirs:
+            if path in self.dirs:
+                continue
+            wd = self.add_watch(self.fd, path.encode(), mask)
+            if wd < 0:
+                Logs.warn('Cannot watch %s: %s' % (path,
+                    os.strerror(ctypes.get_errno())))
+                continue
+            self.wds[wd] = path
+            self.dirs.add(path)
+
+    def read(self, changes):
+        """Add the pending events to changes"""
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                return
+            raise
+        pos = 0
+        while pos < len(data):
+            (wd, mask, cookie, size) = EVENT.unpack_from(data, pos)
+            pos += EVENT.size
+            name = data[pos:pos + size].rstrip(b'\0')
+            if not isinstance(name, str):
+                # Python 3, the Node paths are str
+                name = name.decode('utf-8', 'replace')
+            pos += size
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, assume anything may have changed
+                changes.structure = True
+                continue
+            if wd not in self.wds or not name or IGNORE.search(name):
+                continue
+            path = os.path.join(self.wds[wd], name)
+            changes.paths.add(path)
+            if mask & IN_STRUCTURE:
+                changes.structure = True
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # Watch the new directory before files are added to it
+                self.watch(walk(path))
+
+    def wait(self):
+        """Return the Changes once files changed and settled"""
+        changes = Changes()
+        while not changes:
+            select.select([self.fd], [], [])
+            self.read(changes)
+        while select.select([self.fd], [], [], SETTLE)[0]:
+            self.read(changes)
+        return changes
+
+
+def watcher():
+    """Return the watcher to use: inotify if possible, else polling"""
+    if not getattr(Options.options, 'watch_poll', False):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError, TypeError) as e:
+            # No C library, no inotify in it or no inotify instances left
+            Logs.warn('inotify unavailable (%s), polling instead' % e)
+    return PollWatcher()
+
+def watched_dirs(bld):
+    """Return the set of directories of the design used by the last run"""
+    nodes = set()
+    trees = set()
+    for cont in bld.sff_units_memo.values():
+        for unit in cont.units.values():
+            for key in ('src_dir', 'tb_dir'):
+                try:
+                    trees.update(unit.use(key))
+                except SFFerrors.Error:
+                    pass
+            for key in ('includes', 'tb_includes'):
+                try:
+                    nodes.update(unit.incpath(key)[0])
+                except SFFerrors.Error:
+                    pass
+    for group in bld.groups:
+        for tsk in group:
+            if not isinstance(tsk, Task.Task):
+                continue
+            deps = bld.node_deps.get(tsk.uid(), [])
+            nodes.update(n.parent for n in list(tsk.inputs) + list(deps))
+    dirs = set(n.abspath() for n in nodes if not n.is_child_of(bld.bldnode))
+    for n in trees:
+        dirs.update(walk(n.abspath()))
+    return dirs
+
+def apply_changes(bld, changes):
+    """Make the next run of bld see the changes"""
+    for path in changes.paths:
+        node = bld.root.search_node(path)
+        if node is None:
+            continue
+        try:
+            del node.cache_sig
+        except AttributeError:
+            pass
+        if not os.path.exists(path):
+            node.evict()
+    if changes.structure:
+        bld.sff_units_memo.clear()
+        for attr in ('sff_glob_cache', 'sff_cache_nd', 'sff_scan_edges'):
+            if hasattr(bld, attr):
+                delattr(bld, attr)
+
+def reset(bld):
+    """Drop the tasks of the last run of bld"""
+    bld.groups = []
+    bld.group_names = {}
+    bld.current_group = 0
+    bld.recurse_cache = {}
+    for attr in ('pre_funs', 'post_funs'):
+        if hasattr(bld, attr):
+            delattr(bld, attr)
+
+
+class watch_ctx(Context.Context):
+    """Run a build command every time the design changes"""
+    cmd = 'watch'
+
+    def execute(self):
+        target = 'verify_source'
+        if Options.commands:
+            target = Options.commands.pop(0)
+        bld = Context.create_context(target)
+        if not isinstance(bld, Build.BuildContext):
+            raise Errors.WafError('watch can only run a build command, not '
+                '%r' % target)
+        bld.options = Options.options
+        bld.cmd = target
+        bld.sff_units_memo = {}
+        """The SFFUnitsCont loaded, kept for the next runs"""
+        bld.restore()
+        if not bld.all_envs:
+            bld.load_envs()
+
+        w = watcher()
+        while True:
+            timer = Utils.Timer()
+            try:
+                bld.execute_build()
+            except Errors.WafError as e:
+                Logs.error(e.msg)
+                Logs.error('%r failed (%s)' % (target, timer))
+            else:
+                Logs.info('%r finished successfully (%s)' % (target, timer))
+            dirs = watched_dirs(bld)
+            w.watch(dirs)
+            Logs.info('Watching %d directories, Ctrl-C to stop' % len(dirs))
+            changes = w.wait()
+            Logs.info('%d files changed' % len(changes.paths))
+            apply_changes(bld, changes)
+            reset(bld)
+            bld.sff_watching = True
+            """Only the simulations whose elaboration ran run again"""
@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Compile workers, selected with --compile_workers on the build commands.
+
+Built on waflib/extras/prefork.py: one worker process is forked per build
+thread when the build starts and stays alive until waf exits. The compile
+commands of the SFFCompileTasks are sent to the worker of the thread running
+the task over the prefork socket protocol, instead of waf forking its own,
+much larger, process for each of them.
+
+ncvlog and vlog have no server mode so each command still starts the tool
+and checks out its license. The compile commands are strings, such as
+mkdir -p <lib> && ncvlog ..., so the worker still runs each of them through
+a shell. What the workers remove is the cost of forking waf, which grows
+with the number of units loaded.
+
+The time from sending each request to receiving its result is recorded and
+a summary printed at the end of the build, every request with -v.
+"""
+
+import threading
+import time
+from waflib import Logs
+from waflib import Options
+
+
+class CompileWorkers(object):
+    """
+    The prefork servers of a build and the latency of the requests sent to
+    them. Created by :py:func:`setup` before the build runs.
+    """
+    def __init__(self, bld):
+        from waflib.extras import prefork
+        self.prefork = prefork
+        self.bld = bld
+        prefork.init_key(bld)
+        prefork.init_servers(bld, bld.jobs)
+        self.latencies = []
+        """List of (library name, seconds) in completion order"""
+        bld.add_post_fun(self.report)
+
+    def exec_command(self, name, cmd, **kw):
+        """
+        Run cmd on the worker of the current build thread. name identifies
+        the request in the report.
+        """
+        if getattr(threading.current_thread(), 'idx', None) is None:
+            # Not a build thread set up by prefork
+            return self.bld.exec_command(cmd, **kw)
+        start = time.time()
+        try:
+            return self.prefork.exec_command(self.bld, cmd, **kw)
+        finally:
+            self.latencies.append((name, time.time() - start))
+
+    def report(self, bld):
+        if not self.latencies:
+            return
+        times = [t for (name, t) in self.latencies]
+        if Logs.verbose:
+            for (name, t) in self.latencies:
+                Logs.info('%-40s %8.3fs' % (name, t))
+        Logs.info('Compile workers: %d requests, latency total %.3fs, mean '
+            '%.3fs, max %.3fs' % (len(times), sum(times),
+            sum(times) / len(times), max(times)))
+
+
+def setup(bld):
+    """
+    Start the compile workers of bld if --compile_workers was given, once
+    per build. Must be called before the build runs.
+    """
+    if not getattr(Options.options, 'compile_workers', False):
+        return
+    if getattr(bld, 'sff_workers', None) is None:
+        bld.sff_workers = CompileWorkers(bld)
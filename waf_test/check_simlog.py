@@ -0,0 +1,47 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Check the default patterns of SFFsimlog against sample lines of Incisive,
+Modelsim and UVM. Run with WAFDIR set as for the other tests:
+python check_simlog.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.environ['WAFDIR'])
+sys.path.insert(0, os.environ['WAFDIR'] + '/../waf-extensions')
+from SFFsimlog import OutputMatcher
+
+SAMPLES = [
+    ('ncsim: *F,NOSNAP: Snapshot tb not found.', 'fatal'),
+    ('ncelab: *E,CUVMUR: instance of module/UDP not found.', 'error'),
+    ('ncsim: *W,DSEM2009: This SystemVerilog design is simulated.', None),
+    ('** Fatal: (vsim-3170) Could not find work.tb.', 'fatal'),
+    ('# ** Fatal: (vsim-3170) Could not find work.tb.', 'fatal'),
+    ('# ** Error: tb.sv(12): (vlog-2730) Undefined variable.', 'error'),
+    ('# ** Error (suppressible): (vsim-12110) Option -novopt.', 'error'),
+    ('# ** Warning: (vsim-3015) Port size does not match.', None),
+    ('UVM_FATAL tb.sv(40) @ 10: uvm_test_top [TEST] timeout', 'fatal'),
+    ('# UVM_FATAL @ 0: reporter [NOCOMP] No components', 'fatal'),
+    ('# UVM_ERROR @ 0: uvm_test_top [CHK] mismatch', 'error'),
+    ('# UVM_ERROR :    0', None),
+    ('UVM_FATAL :    0', None),
+]
+"""Lines of each tool and what the default patterns must find in them"""
+
+failed = 0
+for (line, kind) in SAMPLES:
+    m = OutputMatcher()
+    m.feed(line)
+    found = None
+    if m.reason:
+        found = 'fatal'
+    elif m.errors:
+        found = 'error'
+    if found != kind:
+        print('%r: expected %s, matched %s' % (line, kind, found))
+        failed += 1
+print('%d of %d sample lines matched' % (len(SAMPLES) - failed, len(SAMPLES)))
+sys.exit(1 if failed else 0)
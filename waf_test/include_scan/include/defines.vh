@@ -0,0 +1,6 @@
+`ifndef __WAF_TEST_INCLUDE_SCAN
+`define __WAF_TEST_INCLUDE_SCAN
+
+`define INCLUDE_SCAN_NARROW
+
+`endif
@@ -0,0 +1,19 @@
+`include "defines.vh"
+`include "defines.vh"
+
+`ifdef INCLUDE_SCAN_WIDE
+`include "wide.vh"
+`elsif INCLUDE_SCAN_NARROW
+`include "narrow.vh"
+`else
+`include "missing.vh"
+`endif
+
+module include_scan (
+    input [`WIDTH-1:0] a,
+    output [`WIDTH-1:0] b
+);
+
+assign b = a;
+
+endmodule
@@ -0,0 +1,28 @@
+`timescale 1ns / 10ps
+
+`include "defines.vh"
+`include "narrow.vh"
+
+module tb_include_scan;
+
+    logic [`WIDTH-1:0] out;
+    reg [`WIDTH-1:0] in;
+
+    include_scan dut (
+        .b(out),
+        .a(in)
+    );
+
+    initial begin
+        in = 8'h5a;
+        #1;
+        if (out != 8'h5a) begin
+            $display ("%6dns Include Scan TB: Got %h instead of 5a.", $time, out);
+            $stop;
+        end else begin
+            $display ("%6dns Include Scan TB: Got 5a as expected.", $time);
+            $stop(0);
+        end
+    end
+
+endmodule
@@ -1,6 +1,6 @@
 #!/bin/bash
 
-tests=(defaults defaults_n_user basic_dependencies include_only  src_only  tb_include_only tb_only two_src find_src basic_views)
+tests=(defaults defaults_n_user basic_dependencies include_only  src_only  tb_include_only tb_only two_src find_src basic_views include_scan)
 
 #Testing the check option
 for ((i = 0; i < ${#tests[@]}; i++)); do
@@ -20,3 +20,7 @@ for ((i = 0; i < ${#tests[@]}; i++)); do
 
 done
 
+
+printf "\nRunning: check_simlog.py\n"
+python check_simlog.py
+if [ $? -ne 0 ]; then exit 1;  fi